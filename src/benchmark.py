@@ -0,0 +1,202 @@
+"Micro-benchmarks of the pure-Python hot paths."
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import timeit
+from dataclasses import asdict
+from pathlib import Path
+from statistics import median
+
+from constants import BENCHMARK_DIR
+from utils.graphs.states import TaskPlannerState
+from utils.graphs.task_graph import _task_handler
+from utils.llm import fix_task_json
+from utils.save_file import _fix_title, save_state
+from utils.text import compress
+from utils.web_search import SourceCollector
+
+# Number of tasks, queries per search, results per query and characters per text.
+SIZES = {
+    "realistic": {"tasks": 12, "queries": 4, "results": 5, "chars": 2_000},
+    "extreme": {"tasks": 500, "queries": 20, "results": 20, "chars": 20_000},
+}
+REPEAT = 5
+
+
+def make_text(i, chars):
+    """Return a synthetic text of a given length."""
+    sentence = f"Source {i} reports that Acme grew 12% in 2024, see https://acme.com/{i}. "
+    return (sentence * (chars // len(sentence) + 1))[:chars]
+
+
+def make_tasks(size):
+    """Return a plan of searches, creations depending on them and a final format."""
+    tasks = []
+    for i in range(size["tasks"] - 1):
+        if i % 2 == 0:
+            tasks.append(["Search", [f"acme query {i} {j}" for j in range(size["queries"])], []])
+        else:
+            tasks.append(["create", f"analyse {i}", [str(i - 1), i - 2, "x"]])
+    tasks.append(["format", [str(i) for i in range(size["tasks"] - 1)]])
+    return tasks
+
+
+def make_search_results(size):
+    """Return the responses of the queries of a search, half of the results being duplicates."""
+    return [
+        {
+            "results": [
+                {"content": make_text((q + r) // 2, size["chars"] // 4)}
+                for r in range(size["results"])
+            ]
+        }
+        for q in range(size["queries"])
+    ]
+
+
+def deduplicate_sources(search_results):
+    """Deduplicate the sources of search responses, as the searches do when they arrive."""
+    collector = SourceCollector()
+    for index, response in enumerate(search_results):
+        collector.add(index, response)
+    return collector.text()
+
+
+def make_state(size):
+    """Return the state of a plan whose tasks are all done."""
+    tasks = fix_task_json(make_tasks(size))["tasks"]
+    return TaskPlannerState(
+        query="acme",
+        title="Acme",
+        tasks=tasks,
+        task_output=[make_text(i, size["chars"]) for i in range(len(tasks))],
+    )
+
+
+def make_report(size):
+    """Return a markdown report with a front matter title."""
+    return '---\ntitle: "{Acme} report"\n---\n' + make_text(0, size["chars"] * 10)
+
+
+def benchmarks(size, directory):
+    """Return the benchmarked calls for a size of inputs, by name."""
+    tasks = make_tasks(size)
+    search_results = make_search_results(size)
+    state = make_state(size)
+    outputs = state.task_output
+    dependencies = list(range(len(outputs)))
+    markdown = make_report(size)
+    state_args = {
+        task_type: get_args(["acme"], dependencies, outputs)
+        for task_type, (_, _, get_args, _) in _task_handler.items()
+    }
+    path = Path(directory) / "state.json"
+
+    return {
+        "fix_task_json": lambda: fix_task_json(tasks),
+        "source_collector": lambda: deduplicate_sources(search_results),
+        **{
+            f"task_args_{task_type}": (
+                lambda get_args=get_args: get_args(["acme"], dependencies, outputs)
+            )
+            for task_type, (_, _, get_args, _) in _task_handler.items()
+        },
+        "compress": lambda: compress("\n\n".join(outputs), 6000, "acme growth"),
+        "asdict_state": lambda: asdict(state),
+        "save_state": lambda: save_state(state, path),
+        "fix_title": lambda: _fix_title(markdown),
+        **{
+            f"state_{task_type}": (
+                lambda state_class=state_class, task_type=task_type: state_class(
+                    **state_args[task_type]
+                )
+            )
+            for task_type, (_, state_class, _, _) in _task_handler.items()
+        },
+    }
+
+
+def measure(func):
+    """Return the median and best seconds per call of a function."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat=REPEAT, number=number)]
+    return {"median": median(times), "best": min(times), "number": number}
+
+
+def git_commit():
+    """Return the current commit, or an empty string outside of a git repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(names=None):
+    """Run the benchmarks, at every size.
+
+    Args:
+        names (list): Names of the benchmarks to run, all of them if empty.
+
+    Returns:
+        dict: Results by "name[size]", with the commit and Python version.
+
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size_name, size in SIZES.items():
+            for name, func in benchmarks(size, directory).items():
+                if not names or name in names:
+                    results[f"{name}[{size_name}]"] = measure(func)
+    return {"commit": git_commit(), "python": platform.python_version(), "results": results}
+
+
+def report(current, previous=None):
+    """Print the results, compared to previous results if any."""
+    print(f"commit {current['commit'] or '-'}, python {current['python']}")
+    header = f"{'benchmark':<40}{'median':>12}{'best':>12}"
+    print(header + (f"{'vs ' + previous['commit']:>14}" if previous else ""))
+    for name, result in current["results"].items():
+        line = f"{name:<40}{result['median'] * 1e6:>10.1f}us{result['best'] * 1e6:>10.1f}us"
+        if previous and name in previous["results"]:
+            line += f"{result['median'] / previous['results'][name]['median']:>13.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    """
+    Entry point for the benchmarks.
+
+    Results are saved in src/json/benchmarks/<commit>.json, to compare commits with --compare.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all of them by default")
+    parser.add_argument("--compare", help="commit (or json file) to compare with")
+    args = parser.parse_args()
+
+    current = run(args.names)
+    previous = None
+    if args.compare:
+        compare_path = Path(args.compare)
+        if not compare_path.exists():
+            compare_path = BENCHMARK_DIR / f"{args.compare}.json"
+        with Path.open(compare_path, encoding="utf-8") as f:
+            previous = json.load(f)
+    report(current, previous)
+
+    # Results of a commit are merged, so that running some benchmarks keeps the others.
+    Path.mkdir(BENCHMARK_DIR, exist_ok=True, parents=True)
+    result_path = BENCHMARK_DIR / f"{current['commit'] or 'local'}.json"
+    if result_path.exists():
+        with Path.open(result_path, encoding="utf-8") as f:
+            current["results"] = {**json.load(f)["results"], **current["results"]}
+    with Path.open(result_path, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2)
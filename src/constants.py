@@ -7,6 +7,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 OUTPUT_DIR = BASE_DIR / "outputs"
 SRC_DIR = BASE_DIR / "src"
 RECOVERY_DIR = SRC_DIR / "json" / "recovery"
+KNOWLEDGE_DB = SRC_DIR / "json" / "knowledge" / "index.sqlite3"
+GROUNDING_LOG = SRC_DIR / "json" / "grounding.jsonl"
+MEMO_DIR = SRC_DIR / "json" / "memo"
+BENCHMARK_DIR = SRC_DIR / "json" / "benchmarks"
 
 PROMPT_FILE = SRC_DIR / "json" / "prompt.json"
+EXPORT_SCRIPT = SRC_DIR / "lua" / "export.lua"
 CONFIG_FILE = SRC_DIR / "config.toml"
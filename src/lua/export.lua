@@ -0,0 +1,23 @@
+-- Convert a batch of markdown documents in a single pandoc process.
+--
+-- Reads a JSON list of jobs from stdin:
+--   [{"text": "<markdown>", "outputs": [{"format": "docx", "path": "...", "reference_doc": "..."}]}]
+-- Each document is parsed once and written to every requested output.
+
+local jobs = pandoc.json.decode(io.read("a"), false)
+
+for _, job in ipairs(jobs) do
+  local doc = pandoc.read(job.text, "markdown")
+  for _, output in ipairs(job.outputs) do
+    local options = {}
+    if output.reference_doc then
+      options.reference_doc = output.reference_doc
+    end
+    if output.format == "html" then
+      options.template = pandoc.template.compile(pandoc.template.default("html"))
+    end
+    local file = assert(io.open(output.path, "wb"))
+    file:write(pandoc.write(doc, output.format, options))
+    file:close()
+  end
+end
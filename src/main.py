@@ -3,14 +3,46 @@
 import asyncio
 
 from constants import CONFIG_FILE
+from utils.budget import start_budget
 from utils.graphs.task_graph import TaskPlannerState, task_graph_builder
+from utils.llm import default_rate_limiter, llm_flight
 from utils.load_data import load_config, load_tasks_state
-from utils.save_file import md_to_docx, mk_output_dir, save_md
+from utils.prompts import prompt_stats
+from utils.save_file import export_reports, mk_output_dir, save_json, save_md
+from utils.scheduler import start_run
+from utils.web_search import search_flight, search_rate_limiter
 
 config = load_config(CONFIG_FILE)
 
+TASK_EVENTS = {"task_started", "task_finished", "partial_output"}
 
-async def pipeline(query: str):
+
+async def save_report(answer):
+    """Save the final report of a run, with the budget it used.
+
+    Args:
+        answer (dict): Final state of the task graph.
+
+    Returns:
+        Path: Path of the output directory.
+
+    """
+    directory_name = answer["title"]
+    directory = await asyncio.to_thread(mk_output_dir, directory_name)
+    final_report = answer["task_output"][-1]
+    await asyncio.gather(
+        asyncio.to_thread(save_md, final_report, directory),
+        asyncio.to_thread(save_json, answer.get("budget", {}), directory / "budget.json"),
+        export_reports(
+            [(final_report, directory)],
+            config["export"]["formats"],
+            config["export"]["pdf_engine"],
+        ),
+    )
+    return directory
+
+
+async def pipeline(query: str, priority=None):
     """Process the query.
 
     This function orchestrates the entire process, which includes:
@@ -19,19 +51,93 @@ async def pipeline(query: str):
 
     Args:
         query (str): The query to process.
+        priority (float): Share of the LLM and search rate given to the run when other runs
+            are waiting, config["scheduler"]["priority"] by default.
 
     """
+    start_run(query, priority or config["scheduler"]["priority"])
     graph = task_graph_builder()
     state = TaskPlannerState(**load_tasks_state(query))
+    budget_callback = start_budget(state.budget)
 
     answer = await graph.ainvoke(
-        state, {"max_concurrency": config["parameters"]["max_concurrency"]}
+        state,
+        {
+            "max_concurrency": config["parameters"]["max_concurrency"],
+            "callbacks": [budget_callback],
+        },
     )
-    directory_name = answer["title"]
-    directory = mk_output_dir(directory_name)
-    final_report = answer["task_output"][-1]
-    save_md(final_report, directory)
-    md_to_docx(directory)
+    await save_report(answer)
+
+
+async def stream_pipeline(query: str, priority=None):
+    """Process the query, yielding progress events as they happen.
+
+    Events are dictionaries with an "event" key:
+        - "task_started" / "task_finished": index, task_type and total of a planned task.
+        - "partial_output": output of a planned task, or update of a planning node.
+        - "token": content of a streamed LLM token, with the node producing it.
+        - "report": path of the output directory once the report is saved, with the
+          counters of LLM and search calls performed and deduplicated, the queue depth and
+          waiting times of the scheduler, the estimated tokens of each prompt and the budget
+          used.
+
+    Args:
+        query (str): The query to process.
+        priority (float): Share of the LLM and search rate given to the run when other runs
+            are waiting, config["scheduler"]["priority"] by default.
+
+    Yields:
+        dict: Progress event.
+
+    """
+    start_run(query, priority or config["scheduler"]["priority"])
+    graph = task_graph_builder()
+    state = TaskPlannerState(**load_tasks_state(query))
+    budget_callback = start_budget(state.budget)
+
+    answer = None
+    async for event in graph.astream_events(
+        state,
+        {
+            "max_concurrency": config["parameters"]["max_concurrency"],
+            "callbacks": [budget_callback],
+        },
+        version="v2",
+    ):
+        kind = event["event"]
+        if kind == "on_custom_event" and event["name"] in TASK_EVENTS:
+            yield {"event": event["name"], **event["data"]}
+        elif kind == "on_chat_model_stream":
+            yield {
+                "event": "token",
+                "node": event["metadata"].get("langgraph_node"),
+                "content": event["data"]["chunk"].content,
+            }
+        elif kind == "on_chain_end" and not event["parent_ids"]:
+            answer = event["data"]["output"]
+        elif (
+            kind == "on_chain_end"
+            and len(event["parent_ids"]) == 1
+            and event["name"] in {"get_title", "get_tasks"}
+        ):
+            yield {
+                "event": "partial_output",
+                "node": event["name"],
+                "output": event["data"]["output"],
+            }
+
+    directory = await save_report(answer)
+    yield {
+        "event": "report",
+        "path": str(directory),
+        "llm_calls": llm_flight.stats(),
+        "search_calls": search_flight.stats(),
+        "llm_queue": default_rate_limiter.stats(),
+        "search_queue": search_rate_limiter.stats(),
+        "prompts": prompt_stats(),
+        "budget": answer.get("budget", {}),
+    }
 
 
 if __name__ == "__main__":
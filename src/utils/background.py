@@ -0,0 +1,108 @@
+"Bounded backgrounds built from the outputs of the dependencies of a task."
+
+import asyncio
+import os
+from random import randint
+
+from langchain_groq import ChatGroq
+
+from constants import CONFIG_FILE
+from utils import memo
+from utils.graphs.states import DigestState
+from utils.llm import default_rate_limiter, query_llm
+from utils.load_data import load_config
+from utils.text import compress, estimate_tokens
+
+config = load_config(CONFIG_FILE)
+
+
+def allot(sizes, budget):
+    """Share a token budget between parts, giving small parts their size and the rest evenly.
+
+    Args:
+        sizes (list): Estimated tokens of each part.
+        budget (int): Tokens to share.
+
+    Returns:
+        list: Tokens allotted to each part.
+
+    """
+    shares = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for k, i in enumerate(order):
+        shares[i] = min(sizes[i], remaining // (len(sizes) - k))
+        remaining -= shares[i]
+    return shares
+
+
+def digest(text, max_tokens, query, recovery_path):
+    """Digest a text with the LLM within a token budget, reusing the memoized digest if any.
+
+    Args:
+        text (str): Text to digest.
+        max_tokens (int): Token budget of the digest.
+        query (str): Query the digest must stay relevant to.
+        recovery_path (str): Path of the recovery file.
+
+    Returns:
+        str: Digest of the text.
+
+    """
+    # About 3 words every 4 tokens.
+    state = DigestState(
+        text=text, query=query, max_words=max_tokens * 3 // 4, recovery_path=recovery_path
+    )
+    key = memo.task_key("digest", {"text": text, "query": query, "max_words": state.max_words})
+    memoized = memo.load(key)
+    if memoized is not None:
+        return memoized
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+    answer = query_llm(state, llm, "digest")["digest"]
+    memo.save(key, "digest", answer)
+    return answer
+
+
+async def fit(part, share, query, recovery_path):
+    """Compress a dependency output to its share of tokens, if it exceeds it."""
+    if estimate_tokens(part) <= share:
+        return part
+    if config["background"]["method"] == "digest":
+        return await asyncio.to_thread(digest, part, share, query, recovery_path)
+    return compress(part, share, query)
+
+
+async def build_background(parts, query, recovery_prefix):
+    """Compress the dependency outputs of a task so that they fit config["background"].
+
+    Outputs within their share of max_tokens are kept whole, the others are compressed to
+    their share with the configured method.
+
+    Args:
+        parts (list): Outputs of the dependencies.
+        query (str): Query of the task.
+        recovery_prefix (str): Prefix of the recovery files of the digests.
+
+    Returns:
+        list: Outputs, compressed if needed.
+
+    """
+    max_tokens = config["background"]["max_tokens"]
+    sizes = [estimate_tokens(part) for part in parts]
+    if not max_tokens or sum(sizes) <= max_tokens:
+        return parts
+    shares = allot(sizes, max_tokens)
+    return list(
+        await asyncio.gather(
+            *[
+                fit(part, share, query, f"{recovery_prefix}_digest_{i}.json")
+                for i, (part, share) in enumerate(zip(parts, shares))
+            ]
+        )
+    )
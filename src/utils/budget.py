@@ -0,0 +1,143 @@
+"Per-run budget of tokens, API calls and time."
+
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from constants import CONFIG_FILE
+from utils.load_data import load_config
+
+config = load_config(CONFIG_FILE)
+
+budget_config = config["budget"]
+
+current_budget = ContextVar("current_budget", default=None)
+
+
+@dataclass
+class Budget:
+    """Represents the resources used by a run.
+
+    Fields:
+        tokens (int): LLM tokens used.
+        llm_calls (int): LLM calls performed.
+        search_calls (int): Web searches performed.
+        elapsed (float): Seconds spent in previous sessions of the run (recovery).
+        cuts (list): Degradations applied to stay within the budget.
+    """
+
+    tokens: int = 0
+    llm_calls: int = 0
+    search_calls: int = 0
+    elapsed: float = 0.0
+    cuts: list = field(default_factory=list)
+
+    def __post_init__(self):
+        """Start the clock of the current session."""
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def seconds(self):
+        """Return the seconds spent by the run."""
+        return self.elapsed + time.monotonic() - self._started
+
+    def usage(self):
+        """Return the highest fraction of a limit used, ignoring limits set to 0."""
+        used = {
+            "max_tokens": self.tokens,
+            "max_llm_calls": self.llm_calls,
+            "max_search_calls": self.search_calls,
+            "max_seconds": self.seconds(),
+        }
+        return max(
+            (value / budget_config[limit] for limit, value in used.items() if budget_config[limit]),
+            default=0.0,
+        )
+
+    def degraded(self):
+        """Return whether the run is close enough to a limit to degrade."""
+        return self.usage() >= budget_config["degrade_at"]
+
+    def cut(self, message):
+        """Record a degradation, once per message."""
+        with self._lock:
+            if message not in self.cuts:
+                self.cuts.append(message)
+
+    def add_llm_call(self, tokens):
+        """Record an LLM call."""
+        with self._lock:
+            self.llm_calls += 1
+            self.tokens += tokens
+
+    def add_search_calls(self, calls):
+        """Record web searches."""
+        with self._lock:
+            self.search_calls += calls
+
+    def to_dict(self):
+        """Return the usage as a json serializable dictionary."""
+        with self._lock:
+            return {**asdict(self), "elapsed": self.seconds()}
+
+
+class BudgetCallback(BaseCallbackHandler):
+    """Count the LLM calls and tokens of a run."""
+
+    def __init__(self, budget):
+        """Initialise the callback for a budget."""
+        self.budget = budget
+
+    def on_llm_end(self, response, **kwargs):  # noqa: ARG002
+        """Record the tokens of a finished LLM call."""
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                tokens += (usage or {}).get("total_tokens", 0)
+        self.budget.add_llm_call(tokens)
+
+
+def start_budget(usage=None):
+    """Start tracking the budget of a run in the current context.
+
+    Args:
+        usage (dict): Usage saved by a previous session of the run, if any.
+
+    Returns:
+        BudgetCallback: Callback to pass to the graph so that LLM calls are counted.
+
+    """
+    budget = Budget(**(usage or {}))
+    current_budget.set(budget)
+    return BudgetCallback(budget)
+
+
+def degraded(message):
+    """Return whether the current run must degrade, recording the degradation if so.
+
+    Args:
+        message (str): Description of the degradation.
+
+    """
+    budget = current_budget.get()
+    if budget is None or not budget.degraded():
+        return False
+    budget.cut(message)
+    return True
+
+
+def record_search_calls(calls):
+    """Record web searches in the budget of the current run, if any."""
+    budget = current_budget.get()
+    if budget is not None:
+        budget.add_search_calls(calls)
+
+
+def budget_usage():
+    """Return the usage of the current run, if tracked."""
+    budget = current_budget.get()
+    return budget.to_dict() if budget is not None else {}
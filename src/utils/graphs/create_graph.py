@@ -6,8 +6,19 @@ from random import randint
 from langchain_groq import ChatGroq
 from langgraph.graph import END, START, StateGraph
 
+from constants import CONFIG_FILE
 from utils.graphs.states import CreateState
-from utils.llm import check_hallucination, default_rate_limiter, query_llm
+from utils.llm import (
+    check_claims,
+    check_hallucination,
+    default_rate_limiter,
+    fix_claims,
+    grounded,
+    query_llm,
+)
+from utils.load_data import load_config
+
+config = load_config(CONFIG_FILE)
 
 
 def ask_query(x):
@@ -24,11 +35,6 @@ def ask_query(x):
 
 def check_answer(x):
     """Check answer."""
-    human_prompt = (
-        f"Query:\n{x.query}\n\n\n\n"
-        f"AI generated text:\n{x.create_output}\n\n\n\n"
-        f"Background:\n{x.background}"
-    )
     llm = ChatGroq(
         model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
         temperature=0.0,
@@ -36,12 +42,23 @@ def check_answer(x):
         rate_limiter=default_rate_limiter,
         model_kwargs={"seed": randint(0, 2**32)},
     )
-    return check_hallucination(
-        x,
-        llm,
-        "create_output",
-        human_prompt,
+    if grounded(x, "create_output", f"{x.query}\n\n{x.background}"):
+        return {"retry": "no"}
+    if config["hallucination"]["mode"] == "claims":
+        return check_claims(x, llm, "create_output", f"{x.query}\n\n{x.background}")
+    return check_hallucination(x, llm, "create_output")
+
+
+def fix_answer(x):
+    """Fix the unsupported claims of the answer."""
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
     )
+    return fix_claims(x, llm, "create_output", f"{x.query}\n\n{x.background}")
 
 
 def create_graph_builder():
@@ -59,6 +76,7 @@ def create_graph_builder():
 
     graph.add_node("ask_query", ask_query)
     graph.add_node("check_answer", check_answer)
+    graph.add_node("fix_answer", fix_answer)
 
     # ----------------------------------
     # Edges
@@ -66,11 +84,13 @@ def create_graph_builder():
 
     graph.add_edge(START, "ask_query")
     graph.add_edge("ask_query", "check_answer")
+    graph.add_edge("fix_answer", "check_answer")
 
     graph.add_conditional_edges(
         "check_answer",
         lambda s: s.retry,
         {
+            "fix": "fix_answer",
             "yes": "ask_query",
             "no": END,
         },
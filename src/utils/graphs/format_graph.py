@@ -1,13 +1,24 @@
 "Graph definition."
 
+import asyncio
 import os
+from dataclasses import replace
 from random import randint
 
 from langchain_groq import ChatGroq
 from langgraph.graph import END, START, StateGraph
 
-from utils.graphs.states import FormatState
+from constants import CONFIG_FILE
+from utils.graphs.states import FormatState, SectionState
 from utils.llm import default_rate_limiter, query_llm
+from utils.load_data import load_config
+
+config = load_config(CONFIG_FILE)
+
+
+def choose_mode(_):
+    """Choose between the single-pass and the sectioned report generation."""
+    return "get_outline" if config["parameters"]["sectioned_report"] else "get_report"
 
 
 def get_report(x):
@@ -36,6 +47,60 @@ def format_report(x):
     return query_llm(x, llm, "report")
 
 
+def get_outline(x):
+    """Get the title and the list of sections of the report."""
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+    numbered_background = "\n\n".join(f"[{i}]\n{part}" for i, part in enumerate(x.background_parts))
+
+    return query_llm(replace(x, background=numbered_background), llm, "outline", json_output=True)
+
+
+def _section_background(parts, sources):
+    """Join the background parts referenced by a section, or all of them if none is valid."""
+    indices = [i for i in sources if isinstance(i, int) and 0 <= i < len(parts)]
+    return "\n\n".join(parts[i] for i in indices) if indices else "\n\n".join(parts)
+
+
+async def draft_sections(x):
+    """Draft all the sections of the outline concurrently."""
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+    section_states = [
+        SectionState(
+            heading=section.get("heading", ""),
+            description=section.get("description", ""),
+            background=_section_background(x.background_parts, section.get("sources", [])),
+            recovery_path=x.recovery_path.replace(".json", f"_section_{i}.json"),
+        )
+        for i, section in enumerate(x.outline)
+    ]
+    answers = await asyncio.gather(
+        *[asyncio.to_thread(query_llm, state, llm, "section") for state in section_states]
+    )
+    return {"sections": [answer["section"] for answer in answers]}
+
+
+def assemble_report(x):
+    """Assemble the drafted sections in a Pandoc compatible report."""
+    title = x.title.replace('"', "").replace(":", "").strip()
+    body = "\n\n".join(
+        f"# {section.get('heading', '')}\n\n{text.strip()}"
+        for section, text in zip(x.outline, x.sections)
+    )
+    return {"report": f'---\ntitle: "{title}"\n---\n\n{body}\n'}
+
+
 def format_graph_builder():
     """Build and compiles a LangGraph StateGraph.
 
@@ -51,13 +116,23 @@ def format_graph_builder():
 
     graph.add_node("get_report", get_report)
     graph.add_node("format_report", format_report)
+    graph.add_node("get_outline", get_outline)
+    graph.add_node("draft_sections", draft_sections)
+    graph.add_node("assemble_report", assemble_report)
 
     # ----------------------------------
     # Edges
     # ----------------------------------
 
-    graph.add_edge(START, "get_report")
+    graph.add_conditional_edges(START, choose_mode)
     graph.add_edge("get_report", "format_report")
     graph.add_edge("format_report", END)
+    graph.add_conditional_edges(
+        "get_outline",
+        lambda s: "draft_sections" if s.outline else "get_report",
+        ["draft_sections", "get_report"],
+    )
+    graph.add_edge("draft_sections", "assemble_report")
+    graph.add_edge("assemble_report", END)
 
     return graph.compile()
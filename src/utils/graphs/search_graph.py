@@ -1,21 +1,107 @@
 "Graph definition."
 
+import asyncio
 import os
+import sys
+from dataclasses import replace
 from random import randint
 
 from langchain_groq import ChatGroq
 from langgraph.graph import END, START, StateGraph
 
+from constants import CONFIG_FILE
+from utils import memo
 from utils.graphs.states import SearchState
-from utils.llm import check_hallucination, default_rate_limiter, query_llm
-from utils.web_search import web_search
+from utils.llm import (
+    check_claims,
+    check_hallucination,
+    default_rate_limiter,
+    fix_claims,
+    grounded,
+    query_llm,
+)
+from utils.load_data import load_config
+from utils.save_file import asave_state
+from utils.web_search import SourceCollector, stream_search, web_search
+
+config = load_config(CONFIG_FILE)
 
 
 async def get_search(x):
-    """Get search results."""
+    """Get search results, unless they were prefetched."""
+    if x.search_results:
+        return {}
+    if config["search"]["summary_batch"]:
+        return await stream_summary(x)
     return await web_search(x, "search_results", x.queries)
 
 
+async def stream_summary(x):
+    """Get search results and summarise them progressively, as they arrive.
+
+    The summary starts once config["search"]["summary_batch"] responses arrived, and is
+    updated with the sources of the responses arriving meanwhile.
+    """
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+
+    async def summarise(summary, sources):
+        state = replace(
+            x, search_results="\n\n".join(sources), search_summary=summary, load_recovery=False
+        )
+        prompt_name = "SEARCH_SUMMARY_UPDATE_PROMPT" if summary else None
+        answer = await asyncio.to_thread(
+            query_llm, state, llm, "search_summary", prompt_name=prompt_name
+        )
+        return answer["search_summary"]
+
+    collector = SourceCollector()
+    summary, running, new_sources, responses = None, None, [], 0
+    try:
+        async for index, response in stream_search(x.queries):
+            new_sources.extend(collector.add(index, response))
+            responses += 1
+            if running is not None and running.done():
+                summary, running = running.result(), None
+            if running is None and new_sources and responses >= config["search"]["summary_batch"]:
+                running = asyncio.create_task(summarise(summary, new_sources))
+                new_sources, responses = [], 0
+    except Exception as e:
+        print(e)
+        x.load_recovery = True
+        await asave_state(x, x.recovery_path)
+        sys.exit(1)
+    if running is not None:
+        summary = await running
+    if new_sources:
+        summary = await summarise(summary, new_sources)
+    return {"search_results": collector.text(), "search_summary": summary, "load_recovery": False}
+
+
+def summary_key(x):
+    """Return the memo key of the summary of the search results."""
+    return memo.task_key("search", {"queries": x.queries, "search_results": x.search_results})
+
+
+def recall_summary(x):
+    """Reuse the memoized summary of the search results, if any."""
+    memoized = memo.load(summary_key(x))
+    if memoized is None:
+        return {}
+    return {"search_summary": memoized, "memoized": True}
+
+
+def memoize_summary(x):
+    """Memoize the checked summary of the search results."""
+    memo.save(summary_key(x), "search", x.search_summary)
+    return {}
+
+
 def get_summary(x):
     """Summarise search results."""
     llm = ChatGroq(
@@ -38,8 +124,23 @@ def check_summary(x):
         rate_limiter=default_rate_limiter,
         model_kwargs={"seed": randint(0, 2**32)},
     )
-    human_prompt = f"Sources:\n{x.search_results}\n\n\n\nSummary:\n{x.search_summary}"
-    return check_hallucination(x, llm, "search_summary", human_prompt)
+    if grounded(x, "search_summary", x.search_results):
+        return {"retry": "no"}
+    if config["hallucination"]["mode"] == "claims":
+        return check_claims(x, llm, "search_summary", x.search_results)
+    return check_hallucination(x, llm, "search_summary")
+
+
+def fix_summary(x):
+    """Fix the unsupported claims of the summary."""
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+    return fix_claims(x, llm, "search_summary", x.search_results)
 
 
 def search_graph_builder():
@@ -58,22 +159,34 @@ def search_graph_builder():
     graph.add_node("web_search", get_search)
     graph.add_node("get_summary", get_summary)
     graph.add_node("check_summary", check_summary)
+    graph.add_node("fix_summary", fix_summary)
+    graph.add_node("recall_summary", recall_summary)
+    graph.add_node("memoize_summary", memoize_summary)
 
     # ----------------------------------
     # Edges
     # ----------------------------------
 
+    # The memo key holds the search results, so it is looked up once they arrived.
     graph.add_edge(START, "web_search")
-    graph.add_edge("web_search", "get_summary")
+    graph.add_edge("web_search", "recall_summary")
+    graph.add_conditional_edges(
+        "recall_summary",
+        lambda s: END if s.memoized else "check_summary" if s.search_summary else "get_summary",
+        [END, "check_summary", "get_summary"],
+    )
     graph.add_edge("get_summary", "check_summary")
+    graph.add_edge("fix_summary", "check_summary")
 
     graph.add_conditional_edges(
         "check_summary",
         lambda s: s.retry,
         {
+            "fix": "fix_summary",
             "yes": "get_summary",
-            "no": END,
+            "no": "memoize_summary",
         },
     )
+    graph.add_edge("memoize_summary", END)
 
     return graph.compile()
@@ -1,6 +1,8 @@
 "Graph definition."
 
 import os
+import sys
+from dataclasses import replace
 from random import randint
 
 from langchain_groq import ChatGroq
@@ -12,10 +14,15 @@ from utils.graphs.search_graph import search_graph_builder
 from utils.graphs.states import SearchState, SmartSearchState
 from utils.llm import default_rate_limiter, query_llm
 from utils.load_data import load_config
+from utils.save_file import asave_state
+from utils.text import coverage, terms
+from utils.web_search import SourceCollector, stream_search
 
 config = load_config(CONFIG_FILE)
 retry_policy = RetryPolicy(max_attempts=4)
 
+smart_search_config = config["smart_search"]
+
 
 def get_queries(x):
     """Get search results."""
@@ -30,10 +37,102 @@ def get_queries(x):
     return query_llm(x, llm, "smart_search_queries", json_output=True)
 
 
+def choose_mode(_):
+    """Choose between the adaptive and the single-pass search of the queries."""
+    return "search_round" if smart_search_config["adaptive"] else "get_summary"
+
+
+def uncovered(queries, source_terms):
+    """Return the queries whose terms are not covered by the terms of the sources."""
+    return [
+        query
+        for query in queries
+        if coverage(query, source_terms) < smart_search_config["min_coverage"]
+    ]
+
+
+def next_step(x, source_terms):
+    """Choose the next step of the adaptive search, given the terms of the sources found."""
+    if len(x.searched_queries) >= smart_search_config["max_queries"]:
+        return "get_summary"
+    unsearched = [query for query in x.smart_search_queries if query not in x.searched_queries]
+    if uncovered(unsearched, source_terms):
+        return "search_round"
+    if x.smart_search_gaps and x.followup_rounds < smart_search_config["max_followups"]:
+        return "get_followups"
+    return "get_summary"
+
+
+async def search_round(x):
+    """Search the uncovered queries adding the most terms not found yet."""
+    source_terms = terms("\n\n".join(x.smart_search_sources))
+    known_terms = terms(x.background or "") | source_terms
+    unsearched = [query for query in x.smart_search_queries if query not in x.searched_queries]
+    pending = sorted(
+        uncovered(unsearched, source_terms),
+        key=lambda query: len(terms(query) - known_terms),
+        reverse=True,
+    )
+    budget = smart_search_config["max_queries"] - len(x.searched_queries)
+    batch = pending[: min(smart_search_config["queries_per_round"], budget)]
+
+    collector = SourceCollector()
+    try:
+        async for index, response in stream_search(batch):
+            collector.add(index, response)
+    except Exception as e:
+        print(e)
+        x.load_recovery = True
+        await asave_state(x, x.recovery_path)
+        sys.exit(1)
+
+    update = {
+        "smart_search_sources": list(
+            dict.fromkeys([*x.smart_search_sources, *collector.sources()])
+        ),
+        "searched_queries": [*x.searched_queries, *batch],
+    }
+    source_terms = terms("\n\n".join(update["smart_search_sources"]))
+    update["smart_search_gaps"] = uncovered(update["searched_queries"], source_terms)
+    update["smart_search_step"] = next_step(replace(x, **update), source_terms)
+    return update
+
+
+def get_followups(x):
+    """Get refined queries for the searched queries the results do not cover."""
+    llm = ChatGroq(
+        model=os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        temperature=0.0,
+        max_tokens=int(os.getenv("MAX_TOKENS", "8192")),
+        rate_limiter=default_rate_limiter,
+        model_kwargs={"seed": randint(0, 2**32)},
+    )
+
+    answer = query_llm(x, llm, "smart_search_followups", json_output=True)
+    followups = [
+        query
+        for query in answer.get("smart_search_followups", [])
+        if query not in x.smart_search_queries
+    ]
+    return {
+        "smart_search_queries": x.smart_search_queries + followups,
+        "smart_search_followups": followups,
+        "smart_search_gaps": [],
+        "followup_rounds": x.followup_rounds + 1,
+    }
+
+
 async def get_summary(x):
     """Summarise search results."""
     sub_graph = search_graph_builder()
-    sub_state = SearchState(queries=x.smart_search_queries, load_recovery=False)
+    if smart_search_config["adaptive"]:
+        sub_state = SearchState(
+            queries=x.searched_queries,
+            search_results="\n\n".join(x.smart_search_sources),
+            load_recovery=False,
+        )
+    else:
+        sub_state = SearchState(queries=x.smart_search_queries, load_recovery=False)
     answer = await sub_graph.ainvoke(
         sub_state, {"max_concurrency": config["parameters"]["max_concurrency"]}
     )
@@ -54,6 +153,8 @@ def smart_search_graph_builder():
     # ----------------------------------
 
     graph.add_node("get_queries", get_queries, retry=retry_policy)
+    graph.add_node("search_round", search_round)
+    graph.add_node("get_followups", get_followups, retry=retry_policy)
     graph.add_node("get_summary", get_summary)
 
     # ----------------------------------
@@ -61,7 +162,13 @@ def smart_search_graph_builder():
     # ----------------------------------
 
     graph.add_edge(START, "get_queries")
-    graph.add_edge("get_queries", "get_summary")
+    graph.add_conditional_edges("get_queries", choose_mode, ["search_round", "get_summary"])
+    graph.add_conditional_edges(
+        "search_round",
+        lambda s: s.smart_search_step,
+        ["search_round", "get_followups", "get_summary"],
+    )
+    graph.add_edge("get_followups", "search_round")
     graph.add_edge("get_summary", END)
 
     return graph.compile()
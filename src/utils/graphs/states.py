@@ -16,12 +16,15 @@ class BaseState:
         load_recovery (bool): Boolean value for loading recovery files.
         recovery_path (str): Path of the recovery file.
         max_retry (int): Max number of checks in the creation of the tasks.
+        unsupported_claims (list): Claims to verify or fix in claim-level checks, None before
+            the first check.
     """
 
     retry: Optional[bool] = False
     load_recovery: Optional[bool] = False
     recovery_path: Optional[Path] = str(RECOVERY_DIR / "base.json")
     max_retry: Optional[int] = 3
+    unsupported_claims: Optional[list] = None
 
 
 @dataclass
@@ -34,6 +37,7 @@ class TaskPlannerState(BaseState):
         tasks (list): List of tasks to solve the query
         recovery_task (str): First task to execute after the recover file is loaded.
         task_output (list): list of task outputs.
+        budget (dict): Tokens, API calls and time used, with the degradations applied.
         recovery_path (str): Path of the recovery file.
         max_retry (int): Max number of checks in the creation of the tasks.
     """
@@ -43,6 +47,7 @@ class TaskPlannerState(BaseState):
     tasks: Optional[list] = field(default_factory=list)
     recovery_task: Optional[str] = None
     task_output: Optional[list] = field(default_factory=list)
+    budget: Optional[dict] = field(default_factory=dict)
     recovery_path: Optional[Path] = str(RECOVERY_DIR / "task.json")
     max_retry: Optional[int] = 5
 
@@ -70,17 +75,63 @@ class FormatState(BaseState):
 
     Fields:
         background (str): Background information.
+        background_parts (list): Outputs of the dependency tasks, one per task.
         pre_report (str): Preliminary report.
+        title (str): Title of the report (sectioned mode).
+        outline (list): Sections of the report, with the relevant background parts.
+        sections (list): Drafted sections, in outline order.
         formatted_report (str): Final report with PANDOC compatibility.
         recovery_path (str): Path of the recovery file.
     """
 
     background: Optional[str] = None
+    background_parts: Optional[list] = field(default_factory=list)
     pre_report: Optional[str] = None
+    title: Optional[str] = None
+    outline: Optional[list] = field(default_factory=list)
+    sections: Optional[list] = field(default_factory=list)
     report: Optional[str] = None
     recovery_path: Optional[str] = str(RECOVERY_DIR / "format.json")
 
 
+@dataclass
+class SectionState(BaseState):
+    """Represents the state of the drafting of a single report section.
+
+    Fields:
+        heading (str): Heading of the section.
+        description (str): Expected content of the section.
+        background (str): Background information relevant to the section.
+        section (str): Drafted section.
+        recovery_path (str): Path of the recovery file.
+    """
+
+    heading: Optional[str] = None
+    description: Optional[str] = None
+    background: Optional[str] = None
+    section: Optional[str] = None
+    recovery_path: Optional[str] = str(RECOVERY_DIR / "section.json")
+
+
+@dataclass
+class DigestState(BaseState):
+    """Represents the state of the digest of a dependency output.
+
+    Fields:
+        text (str): Output to digest.
+        query (str): Query of the task using the digest.
+        max_words (int): Length limit of the digest.
+        digest (str): Digest of the output.
+        recovery_path (str): Path of the recovery file.
+    """
+
+    text: Optional[str] = None
+    query: Optional[str] = None
+    max_words: Optional[int] = None
+    digest: Optional[str] = None
+    recovery_path: Optional[str] = str(RECOVERY_DIR / "digest.json")
+
+
 @dataclass
 class SearchState(BaseState):
     """Represents the state of the search process.
@@ -89,11 +140,13 @@ class SearchState(BaseState):
         queries (list): User queries.
         search_results (str): Query results.
         search_summary (str): Summary of the results.
+        memoized (bool): Whether the summary is the memoized summary of the results.
     """
 
     queries: Optional[list] = field(default_factory=list)
     search_results: Optional[str] = None
     search_summary: Optional[str] = None
+    memoized: Optional[bool] = False
 
 
 @dataclass
@@ -103,11 +156,23 @@ class SmartSearchState(BaseState):
     Fields:
         background (str): Background material.
         smart_search_queries (str): AI-generated search queries.
+        searched_queries (list): Queries searched so far.
+        smart_search_sources (list): Deduplicated sources found so far.
+        smart_search_gaps (list): Searched queries whose results do not cover them.
+        smart_search_followups (list): Refined queries generated for the gaps.
+        followup_rounds (int): Number of follow-up queries generations.
+        smart_search_step (str): Next step of the adaptive search.
         smart_search_summary (str): Summary of the results.
         recovery_path (Path): Path of the recovery file.
     """
 
     background: Optional[str] = None
     smart_search_queries: Optional[list] = field(default_factory=list)
+    searched_queries: Optional[list] = field(default_factory=list)
+    smart_search_sources: Optional[list] = field(default_factory=list)
+    smart_search_gaps: Optional[list] = field(default_factory=list)
+    smart_search_followups: Optional[list] = field(default_factory=list)
+    followup_rounds: Optional[int] = 0
+    smart_search_step: Optional[str] = None
     smart_search_summary: Optional[str] = None
     recovery_path: Optional[str] = str(RECOVERY_DIR / "smart_search.json")
@@ -1,16 +1,21 @@
 "Graph definition."
 
+import asyncio
 import os
 import shutil
 import sys
 from pathlib import Path
 from random import randint
 
+from langchain_core.callbacks.manager import adispatch_custom_event
 from langchain_groq import ChatGroq
 from langgraph.graph import END, START, StateGraph
 from langgraph.pregel import RetryPolicy
 
 from constants import CONFIG_FILE, RECOVERY_DIR
+from utils import knowledge, memo, prefetch
+from utils.background import build_background
+from utils.budget import budget_usage, degraded
 from utils.graphs.create_graph import create_graph_builder
 from utils.graphs.format_graph import format_graph_builder
 from utils.graphs.search_graph import search_graph_builder
@@ -22,9 +27,11 @@ from utils.graphs.states import (
     SmartSearchState,
     TaskPlannerState,
 )
-from utils.llm import default_rate_limiter, human_validation_tasks, query_llm
+from utils.llm import default_rate_limiter, fix_task_json, human_validation_tasks, query_llm
 from utils.load_data import load_config
-from utils.save_file import save_state
+from utils.save_file import asave_state, mk_output_dir, save_task_output
+from utils.scheduler import CRITICAL, GENERATION, call_class
+from utils.web_search import collect_sources
 
 config = load_config(CONFIG_FILE)
 
@@ -54,7 +61,10 @@ _task_handler = {
     "format": (
         format_graph_builder,
         FormatState,
-        lambda _, d, a,: {"background": "\n\n".join([a[i] for i in d])},
+        lambda _, d, a: {
+            "background": "\n\n".join([a[i] for i in d]),
+            "background_parts": [a[i] for i in d],
+        },
         "report",
     ),
     "smart_search": (
@@ -66,6 +76,32 @@ _task_handler = {
 }
 
 
+def truncate_background(state_args):
+    """Truncate the background of a task to config["budget"]["degraded_background_chars"]."""
+    max_chars = config["budget"]["degraded_background_chars"]
+    if "background" in state_args:
+        state_args["background"] = state_args["background"][:max_chars]
+    if state_args.get("background_parts"):
+        part_chars = max_chars // len(state_args["background_parts"])
+        state_args["background_parts"] = [
+            part[:part_chars] for part in state_args["background_parts"]
+        ]
+    return state_args
+
+
+def critical_tasks(tasks):
+    """Return the indices of the tasks on the longest dependency chain ending at the last task."""
+    depths = []
+    for _, _, dependencies in tasks:
+        depths.append(1 + max((depths[j] for j in dependencies), default=0))
+    critical = set()
+    i = len(tasks) - 1
+    while i >= 0:
+        critical.add(i)
+        i = max(tasks[i][2], key=lambda j: (depths[j], j), default=-1)
+    return critical
+
+
 def check_recovery(x):
     """Check the presence of the recovery state."""
     match (x.load_recovery, bool(x.tasks)):
@@ -87,7 +123,8 @@ def get_title(x):
         model_kwargs={"seed": randint(0, 2**32)},
     )
 
-    return query_llm(x, llm, "title")
+    with call_class(CRITICAL):
+        return query_llm(x, llm, "title")
 
 
 def get_recovery_path(x):
@@ -107,7 +144,45 @@ def get_tasks(x):
         model_kwargs={"seed": randint(0, 2**32)},
     )
 
-    return query_llm(x, llm, "tasks", json_output=True)
+    with call_class(CRITICAL):
+        answer = query_llm(x, llm, "tasks", json_output=True)
+    # Plans that can be fixed are normalised here, so that the prefetched, validated and
+    # executed tasks are the same.
+    fixed_tasks = fix_task_json(answer.get("tasks", []))
+    if fixed_tasks:
+        answer["tasks"] = fixed_tasks["tasks"]
+    return answer
+
+
+async def prefetch_searches(x):
+    """Start the planned searches in the background while the plan is reviewed."""
+    if not config["prefetch"]["enabled"] or not fix_task_json(x.tasks):
+        return {}
+    recovery_directory = RECOVERY_DIR / x.title.replace(" ", "_")
+
+    async def fetch(i, queries):
+        # Failures are raised, so that the task is run again instead of ending the run.
+        search_results = await collect_sources(queries)
+        if not config["prefetch"]["summaries"]:
+            return {"search_results": search_results}
+        try:
+            answer = await run_subgraph(
+                search_graph_builder,
+                SearchState,
+                {
+                    "queries": queries,
+                    "search_results": search_results,
+                    "load_recovery": False,
+                    "recovery_path": str(recovery_directory / f"search_{i}_prefetch.json"),
+                },
+            )
+        except SystemExit as e:
+            message = f"Summary of search {i} failed."
+            raise RuntimeError(message) from e
+        return {"search_results": search_results, "search_summary": answer["search_summary"]}
+
+    prefetch.start(x.recovery_path, x.tasks, fetch)
+    return {}
 
 
 def check_tasks(x):
@@ -119,7 +194,59 @@ def check_tasks(x):
         rate_limiter=default_rate_limiter,
         model_kwargs={"seed": randint(0, 2**32)},
     )
-    return human_validation_tasks(x, llm)
+    with call_class(CRITICAL):
+        return human_validation_tasks(x, llm)
+
+
+async def task_args(task_type, query, parts, recovery_prefix):
+    """Return the initial state of a task, from the outputs of its dependencies."""
+    _, _, get_args, _ = _task_handler[task_type]
+    if task_type != "search":
+        parts = await build_background(parts, query, recovery_prefix)
+    state_args = get_args(query, range(len(parts)), parts)
+    state_args["load_recovery"] = False
+    state_args["recovery_path"] = f"{recovery_prefix}.json"
+    if "background" in state_args and degraded("Task backgrounds truncated."):
+        state_args = truncate_background(state_args)
+    return state_args
+
+
+async def run_task(task_type, state_args, critical):
+    """Run a task, unless its output is memoized or was prefetched.
+
+    Search summaries are memoized by the search graph, once the search results arrived.
+
+    Returns:
+        tuple: Output of the task, and whether it was memoized.
+
+    """
+    builder, state_class, _, summary_field = _task_handler[task_type]
+    if summary_field in state_args:
+        return state_args[summary_field], False
+    memoize = task_type != "search"
+    key = memo.task_key(task_type, state_args) if memoize else None
+    memoized = await asyncio.to_thread(memo.load, key) if memoize else None
+    if memoized is not None:
+        return memoized, True
+    with call_class(CRITICAL if critical else GENERATION):
+        answer = await run_subgraph(builder, state_class, state_args)
+    if memoize:
+        await asyncio.to_thread(memo.save, key, task_type, answer[summary_field])
+    return answer[summary_field], answer.get("memoized", False)
+
+
+async def finish_task(event, query, output, output_directory):
+    """Index, save and report the output of a finished task."""
+    task_type = event["task_type"]
+    if task_type in {"search", "smart_search"} and not event.get("memoized"):
+        await asyncio.to_thread(knowledge.add_summary, output, query)
+    if config["parameters"]["save_task_outputs"]:
+        path = await asyncio.to_thread(
+            save_task_output, output, output_directory, event["index"], task_type
+        )
+        event = {**event, "path": str(path)}
+    await adispatch_custom_event("partial_output", {**event, "output": output})
+    await adispatch_custom_event("task_finished", event)
 
 
 async def execute_tasks(x):
@@ -127,30 +254,46 @@ async def execute_tasks(x):
     recovery_file_path = x.recovery_path
     recovery_directory = RECOVERY_DIR / x.title.replace(" ", "_")
 
+    output_directory = await asyncio.to_thread(mk_output_dir, x.title)
+
     first_task_index = len(x.task_output)
     task_output = x.task_output
     remaining_tasks = x.tasks[first_task_index:]
+    critical = critical_tasks(x.tasks)
+    prefetched = prefetch.take(x.recovery_path, x.tasks)
 
     for i, (task_type, query, background) in enumerate(remaining_tasks):
         updated_i = i + first_task_index
-        builder, state_class, get_args, summary_field = _task_handler[task_type]
-        state_args = get_args(query, background, task_output)
-        state_args["load_recovery"] = False
-        state_args["recovery_path"] = str(recovery_directory / f"{task_type}_{updated_i!s}.json")
+        state_args = await task_args(
+            task_type,
+            query,
+            [task_output[j] for j in background],
+            str(recovery_directory / f"{task_type}_{updated_i!s}"),
+        )
         x.task_output = task_output
-        save_state(x, recovery_file_path)
+        x.budget = budget_usage()
+        asave_state(x, recovery_file_path)
+        event = {"index": updated_i, "task_type": task_type, "total": len(x.tasks)}
+        await adispatch_custom_event("task_started", event)
+        prefetched_result = await prefetch.result(prefetched, updated_i)
+        if prefetched_result is not None:
+            state_args.update(prefetched_result)
         try:
-            answer = await run_subgraph(builder, state_class, state_args)
-            task_output.append(answer[summary_field])
+            output, memoized = await run_task(task_type, state_args, updated_i in critical)
+            task_output.append(output)
         except Exception as e:
             print(f"Error in task {updated_i}: {task_type}.\n\n{e}")
+            await asave_state(x, recovery_file_path)
             sys.exit(1)
-    if config["parameters"]["save_final_state"]:
-        save_state(x, recovery_file_path)
-    else:
-        shutil.rmtree(recovery_directory)
+        if memoized:
+            event = {**event, "memoized": True}
+        await finish_task(event, query, output, output_directory)
+    x.budget = budget_usage()
+    await asave_state(x, recovery_file_path)
+    if not config["parameters"]["save_final_state"]:
+        await asyncio.to_thread(shutil.rmtree, recovery_directory)
 
-    return {"task_output": task_output}
+    return {"task_output": task_output, "budget": x.budget}
 
 
 def task_graph_builder():
@@ -170,6 +313,7 @@ def task_graph_builder():
     graph.add_node("get_title", get_title)
     graph.add_node("get_recovery_path", get_recovery_path)
     graph.add_node("get_tasks", get_tasks, retry=retry_policy)
+    graph.add_node("prefetch_searches", prefetch_searches)
 
     graph.add_node(
         "check_tasks",
@@ -186,7 +330,8 @@ def task_graph_builder():
     graph.add_conditional_edges("check_recovery", lambda s: s.recovery_task)
     graph.add_edge("get_title", "get_recovery_path")
     graph.add_edge("get_recovery_path", "get_tasks")
-    graph.add_edge("get_tasks", "check_tasks")
+    graph.add_edge("get_tasks", "prefetch_searches")
+    graph.add_edge("prefetch_searches", "check_tasks")
     graph.add_conditional_edges(
         "check_tasks",
         lambda s: s.retry,
@@ -0,0 +1,114 @@
+"Local knowledge index of the previous searches."
+
+import re
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from constants import CONFIG_FILE, KNOWLEDGE_DB
+from utils.load_data import load_config
+from utils.text import terms
+
+config = load_config(CONFIG_FILE)
+
+knowledge_config = config["knowledge"]
+
+URL = re.compile(r"https?://[^\s)\]>\"']+")
+
+
+@contextmanager
+def _connect():
+    """Open a transaction on the index, creating it if missing."""
+    Path.mkdir(KNOWLEDGE_DB.parent, exist_ok=True, parents=True)
+    with closing(sqlite3.connect(KNOWLEDGE_DB)) as connection, connection:
+        connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            "content, url UNINDEXED, query UNINDEXED, kind UNINDEXED, timestamp UNINDEXED)"
+        )
+        yield connection
+
+
+def _cutoff():
+    """Return the timestamp before which entries are stale."""
+    return time.time() - knowledge_config["max_age_days"] * 86400
+
+
+def lookup(query):
+    """Find fresh chunks answering a query in the index.
+
+    The chunks of a previous identical search are returned if fresh. Otherwise, the index
+    is searched lexically and the chunks containing at least knowledge.min_coverage of the
+    query terms are returned, if at least knowledge.min_results of them are found.
+
+    Args:
+        query (str): Search query.
+
+    Returns:
+        list: Matching entries as dictionaries with content and url, empty if the query
+        must be searched on the web.
+
+    """
+    if not knowledge_config["enabled"]:
+        return []
+    with _connect() as connection:
+        rows = connection.execute(
+            "SELECT content, url FROM chunks WHERE query = ? AND kind = 'chunk' AND timestamp >= ?",
+            (query, _cutoff()),
+        ).fetchall()
+        if rows:
+            return [{"content": content, "url": url} for content, url in rows]
+
+        query_terms = terms(query)
+        if not query_terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in query_terms)
+        rows = connection.execute(
+            "SELECT content, url FROM chunks WHERE chunks MATCH ? AND timestamp >= ? "
+            "ORDER BY bm25(chunks) LIMIT ?",
+            (match, _cutoff(), 4 * knowledge_config["min_results"]),
+        ).fetchall()
+    covering = [
+        {"content": content, "url": url}
+        for content, url in rows
+        if len(query_terms & terms(content)) >= knowledge_config["min_coverage"] * len(query_terms)
+    ]
+    return covering if len(covering) >= knowledge_config["min_results"] else []
+
+
+def add_search(query, results):
+    """Store the results of a web search, replacing the previous results of the query.
+
+    Args:
+        query (str): Search query.
+        results (list): Tavily results, with content and url.
+
+    """
+    if not knowledge_config["enabled"]:
+        return
+    timestamp = time.time()
+    with _connect() as connection:
+        connection.execute("DELETE FROM chunks WHERE query = ? AND kind = 'chunk'", (query,))
+        connection.executemany(
+            "INSERT INTO chunks VALUES (?, ?, ?, 'chunk', ?)",
+            [(entry["content"], entry.get("url", ""), query, timestamp) for entry in results],
+        )
+
+
+def add_summary(summary, query):
+    """Store the summary of a search task, with the URLs it cites.
+
+    Args:
+        summary (str): Summary of the search.
+        query (str | list): Query or queries of the task that produced the summary.
+
+    """
+    if not knowledge_config["enabled"]:
+        return
+    query = "; ".join(query) if isinstance(query, list) else query
+    urls = " ".join(dict.fromkeys(URL.findall(summary)))
+    with _connect() as connection:
+        connection.execute(
+            "INSERT INTO chunks VALUES (?, ?, ?, 'summary', ?)",
+            (summary, urls, query, time.time()),
+        )
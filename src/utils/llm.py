@@ -1,35 +1,131 @@
 "LLM querying functions."
 
 import json
+import random
+import re
 import sys
+import time
 from pathlib import Path
 
-from langchain.prompts import PromptTemplate
+from dotenv import load_dotenv
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.utils.json import parse_partial_json
 
-from constants import CONFIG_FILE, PROMPT_FILE
-from utils.save_file import save_state
-
-with Path.open(PROMPT_FILE) as file:
-    PROMPTS = json.load(file)
-
-from dotenv import load_dotenv
-
+from constants import CONFIG_FILE, GROUNDING_LOG
+from utils import prompts
+from utils.budget import degraded
 from utils.load_data import load_api_key, load_config
+from utils.save_file import save_state
+from utils.scheduler import VERIFICATION, FairRateLimiter, call_class
+from utils.schemas import JSON_SCHEMAS
+from utils.single_flight import SingleFlight
+from utils.text import BULLET, grounding_score, rank_chunks, split_chunks, split_claims
 
 config = load_config(CONFIG_FILE)
 load_api_key({'groq'})
 load_dotenv()
 
 
-default_rate_limiter = InMemoryRateLimiter(
-    requests_per_second=4,
-    check_every_n_seconds=0.1,
-    max_bucket_size=10,
+default_rate_limiter = FairRateLimiter(
+    InMemoryRateLimiter(
+        requests_per_second=4,
+        check_every_n_seconds=0.1,
+        max_bucket_size=10,
+    )
 )
 
+llm_flight = SingleFlight()
+
+
+SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+
+def parse_json(text):
+    """Parse a JSON object generated by an LLM, repairing common defects locally.
+
+    Surrounding text and markdown fences, smart quotes, trailing commas and output
+    truncated before the closing brackets are repaired before giving up.
+
+    Args:
+        text (str): LLM output.
+
+    Returns:
+        dict: Parsed JSON object.
+
+    Raises:
+        ValueError: If no JSON object can be recovered.
+
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    start = text.find("{")
+    end = text.rfind("}")
+    candidates = [text[start : end + 1], text[start:]] if end > start else [text[start:]]
+    for candidate in candidates if start >= 0 else []:
+        repaired = TRAILING_COMMA.sub(r"\1", candidate.translate(SMART_QUOTES))
+        try:
+            parsed = parse_partial_json(repaired)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    message = f"No JSON object found in the LLM output:\n{text}"
+    raise ValueError(message)
+
+
+def json_chain(llm, field_name):
+    """Build a chain returning the JSON object described by the schema of a field.
+
+    Depending on config["llm"]["structured_output"], the schema is enforced with tool
+    calling ("function_calling"), the provider JSON mode ("json_mode") or only validated
+    after parsing the free text ("none").
+
+    Args:
+        llm (ChatGroq): Language model instance.
+        field_name (str): Name of the field.
+
+    Returns:
+        Runnable: Chain from the rendered prompt to a dictionary.
+
+    """
+    schema = JSON_SCHEMAS[field_name]
+    structured_output = config["llm"]["structured_output"]
+    if structured_output == "function_calling":
+        structured_llm = llm.with_structured_output(schema, method="function_calling")
+        return structured_llm | (lambda answer: answer.model_dump())
+    if structured_output == "json_mode":
+        llm = llm.bind(response_format={"type": "json_object"})
+    return (
+        llm
+        | StrOutputParser()
+        | (lambda text: schema.model_validate(parse_json(text)).model_dump())
+    )
+
+
+def _fix_task(task, i):
+    """Normalise a single task, returning None if it cannot be fixed."""
+    task_type = str(task[0]).strip().lower().replace(" ", "_")
+    if task_type not in {"format", "create", "smart_search", "search"}:
+        return None
+    task_length = config["parameters"]["task_length"]
+    if task_type in {"format", "smart_search"} and len(task) == task_length - 1:
+        task = [task_type, "", task[1]]
+    if len(task) != task_length:
+        return None
+    content = task[1]
+    if task_type == "search" and isinstance(content, str):
+        content = [content]
+    if task_type == "create" and isinstance(content, list):
+        content = " ".join(str(query) for query in content)
+    if task_type == "create" and content == "":
+        return None
+    dependencies = [int(j) for j in task[2] if str(j).strip().isdigit() and int(j) < i]
+    return [task_type, content, dependencies]
+
 
 def fix_task_json(tasks):
     """Try to fix the json file if possible.
@@ -45,19 +141,10 @@ def fix_task_json(tasks):
 
     try:
         for i, task in enumerate(tasks):
-            new_task = task
-            if task[0] not in {"format", "create", "smart_search", "search"}:
-                return {}
-            if (
-                task[0] in {"format", "smart_search"}
-                and len(task) == config["parameters"]["task_length"] - 1
-            ):
-                new_task = [task[0], "", task[1]]
-            if len(new_task) != config["parameters"]["task_length"]:
+            new_task = _fix_task(task, i)
+            if new_task is None:
                 return {}
-            if task[0] == "create" and task[1] == "":
-                return {}
-            checked_tasks.append([new_task[0], new_task[1], [j for j in new_task[2] if j < i]])
+            checked_tasks.append(new_task)
         return {"tasks": checked_tasks}
     except Exception:
         return {}
@@ -83,24 +170,23 @@ def human_validation_tasks(state, llm):
         print(message)
         save_state(state, state.recovery_path)
         sys.exit(1)
-    prompt_name = "TASKS_VALIDATION_PROMPT"
     field_state = fix_task_json(state.tasks).get("tasks", "")
     if not field_state:
         return {"retry": "yes", "max_retry": state.max_retry - 1}
-    prompt = PromptTemplate(template=PROMPTS[prompt_name].get("text"), input_variables=["tasks"])
-    prompt_chain = prompt | llm | StrOutputParser()
-    llm_answer = prompt_chain.invoke(field_state)
+    rendered_prompt = prompts.render("TASKS_VALIDATION_PROMPT", {"tasks": field_state})
+    prompt_chain = llm | StrOutputParser()
+    llm_answer = prompt_chain.invoke(rendered_prompt)
     print(f"\nSUGGESTED WORKFLOW:\n\n{llm_answer}\n\n")
     while True:
         user_answer = input("Proceed? (y/n): ")
         if user_answer:
             if user_answer[0].lower() == "y":
-                return {"retry": "no"}
+                return {"retry": "no", "tasks": field_state}
             if user_answer[0].lower() == "n":
                 return {"retry": "yes", "max_retry": state.max_retry - 1}
 
 
-def query_llm(state, llm, field_name, json_output=False):
+def query_llm(state, llm, field_name, json_output=False, prompt_name=None):
     """Construct and runs a prompt chain with the LLM based on the given state and prompt.
 
     Args:
@@ -108,30 +194,38 @@ def query_llm(state, llm, field_name, json_output=False):
         llm (ChatGroq): Language model instance.
         field_name (str): Key name for returning the result.
         json_output (bool): Whether the output is expected to be a json file.
+        prompt_name (str): Name of the prompt, f"{field_name.upper()}_PROMPT" by default.
 
     Returns:
-        dict: Result dictionary with the LLM response under field_name.
+        dict: Result dictionary with the LLM response under field_name, empty if a JSON
+            output is invalid.
 
     """
-    prompt_name = f"{field_name.upper()}_PROMPT"
+    prompt_name = prompt_name or f"{field_name.upper()}_PROMPT"
     if not state.load_recovery or (
         getattr(state, field_name) is None or not getattr(state, field_name)
     ):
         state.load_recovery = False
-        keys = PROMPTS[prompt_name].get("keywords", [])
-        text = PROMPTS[prompt_name].get("text", "")
-
-        relevant_states = {key: getattr(state, key) for key in keys}
-
-        prompt = PromptTemplate(template=text, input_variables=keys)
+        relevant_states = {key: getattr(state, key) for key in prompts.keywords(prompt_name)}
         try:
+            rendered_prompt = prompts.render(prompt_name, relevant_states)
+            flight_key = (llm.model_name, llm.temperature, json_output, rendered_prompt)
             if not json_output:
-                prompt_chain = prompt | llm | StrOutputParser()
-                llm_answer = prompt_chain.invoke(relevant_states)
+                prompt_chain = llm | StrOutputParser()
+                llm_answer = llm_flight.run(
+                    flight_key, lambda: prompt_chain.invoke(rendered_prompt)
+                )
                 return {field_name: getattr(llm_answer, "content", llm_answer)}
-            prompt_chain = prompt | llm | StrOutputParser()
-            llm_answer = json.loads(prompt_chain.invoke(relevant_states))
-            answer = dict(llm_answer)
+            prompt_chain = json_chain(llm, field_name)
+            try:
+                answer = dict(
+                    llm_flight.run(flight_key, lambda: prompt_chain.invoke(rendered_prompt))
+                )
+            except ValueError as e:
+                # Outputs that cannot be repaired or do not match the schema are left empty,
+                # for the caller to regenerate them or fall back.
+                print(e)
+                answer = {field_name: []}
             answer["load_recovery"] = False
             return dict(answer)
 
@@ -145,33 +239,64 @@ def query_llm(state, llm, field_name, json_output=False):
         return {}
 
 
-def check_hallucination(state, llm, field_name, human_prompt=""):
+def grounded(state, field_name, sources):
+    """Decide locally whether a field is grounded enough in its sources to skip the grader.
+
+    Clearly grounded fields skip the grader, except for a random sample of them. Every
+    decision is appended to the grounding audit log.
+
+    Args:
+        state (dict): Input state containing the field to validate.
+        field_name (str): Field to check.
+        sources (str): Material the field must be grounded in.
+
+    Returns:
+        bool: Whether the LLM grader can be skipped.
+
+    """
+    if state.load_recovery or state.unsupported_claims:
+        return False
+    score = grounding_score(getattr(state, field_name), sources)
+    clearly_grounded = score >= config["hallucination"]["skip_above"]
+    skip = clearly_grounded and random.random() >= config["hallucination"]["sample_rate"]
+    decision = {
+        "timestamp": time.time(),
+        "field": field_name,
+        "recovery_path": state.recovery_path,
+        "score": round(score, 3),
+        "grader": "skipped" if skip else ("sampled" if clearly_grounded else "required"),
+    }
+    with Path.open(GROUNDING_LOG, "a", encoding="utf-8") as file:
+        file.write(json.dumps(decision) + "\n")
+    return skip
+
+
+def check_hallucination(state, llm, field_name):
     """Check a given field in the state for hallucinations using a dedicated grading prompt.
 
+    The grading prompt holds the field and the material it must be grounded in.
+
     Args:
         state (dict): Input state containing the field to validate.
         llm (ChatGroq): Language model instance used for the grading.
         field_name (str): Field to check.
-        human_prompt (str): Hallucination data.
 
     Returns:
         dict: "yes" if no hallucination detected, "no" otherwise.
 
     """
     if not state.load_recovery:
+        if degraded("Hallucination checks skipped."):
+            return {"retry": "no"}
         max_retry = state.max_retry
         if max_retry <= 0:
             hallucination_message = (
                 f"WARNING **HALLUCINATION DETECTED**\n\n{getattr(state, field_name)}"
             )
             return {"retry": "no", field_name: hallucination_message}
-        system_prompt = PROMPTS[f"{field_name.upper()}_HALLUCINATION"].get("text", "")
-        human_prompt = f"{field_name.replace('_', ' ')}: {getattr(state, field_name)}"
-        prompt = ChatPromptTemplate.from_messages(
-            [("system", system_prompt), ("human", human_prompt)]
-        )
-
-        hallucination_grader = prompt | llm | StrOutputParser()
+        prompt_name = f"{field_name.upper()}_HALLUCINATION"
+        values = {key: getattr(state, key) for key in prompts.keywords(prompt_name)}
+        hallucination_grader = llm | StrOutputParser()
         score = ""
         while score not in {"yes", "no"}:
             try:
@@ -185,7 +310,9 @@ def check_hallucination(state, llm, field_name, human_prompt=""):
                         "max_retry": max_retry,
                     }
                 max_retry = max_retry - 1
-                score = hallucination_grader.invoke({})
+                messages = prompts.render(prompt_name, values)
+                with call_class(VERIFICATION):
+                    score = hallucination_grader.invoke(messages)
             except Exception as e:
                 print(e)
                 state.load_recovery = True
@@ -196,3 +323,120 @@ def check_hallucination(state, llm, field_name, human_prompt=""):
                 sys.exit(1)
         return {"retry": score, "max_retry": max_retry}
     return {"retry": "no"}
+
+
+def _save_and_exit(state, error):
+    """Save the state for recovery and exit after a failed LLM call."""
+    print(error)
+    state.load_recovery = True
+    save_state(state, state.recovery_path)
+    sys.exit(1)
+
+
+def check_claims(state, llm, field_name, sources):
+    """Verify the claims of a field concurrently, in batches, against the relevant sources.
+
+    All the claims are verified on the first check, only the rewritten ones afterwards: the
+    check ends once a fix removed every unsupported claim.
+
+    Args:
+        state (dict): Input state containing the field to validate.
+        llm (ChatGroq): Language model instance used for the grading.
+        field_name (str): Field to check.
+        sources (str): Material the field must be grounded in.
+
+    Returns:
+        dict: "fix" and the unsupported claims if any, "no" otherwise.
+
+    """
+    if state.load_recovery or degraded("Hallucination checks skipped."):
+        return {"retry": "no"}
+    text = getattr(state, field_name)
+    claims = split_claims(text) if state.unsupported_claims is None else state.unsupported_claims
+    if not claims:
+        return {"retry": "no", "unsupported_claims": []}
+    claims_per_batch = config["hallucination"]["claims_per_batch"]
+    batches = [claims[i : i + claims_per_batch] for i in range(0, len(claims), claims_per_batch)]
+    source_chunks = split_chunks(sources)
+    inputs = [
+        {
+            "sources": "\n\n".join(
+                rank_chunks(
+                    source_chunks, " ".join(batch), config["hallucination"]["sources_per_batch"]
+                )
+            ),
+            "claims": "\n".join(f"{i + 1}. {claim}" for i, claim in enumerate(batch)),
+        }
+        for batch in batches
+    ]
+    grader = llm | StrOutputParser()
+    try:
+        messages = [prompts.render("CLAIMS_HALLUCINATION", values) for values in inputs]
+        with call_class(VERIFICATION):
+            answers = grader.batch(
+                messages, {"max_concurrency": config["hallucination"]["max_concurrency"]}
+            )
+    except Exception as e:
+        _save_and_exit(state, e)
+
+    unsupported = []
+    for batch, answer in zip(batches, answers):
+        try:
+            numbers = set(parse_json(answer).get("unsupported", []))
+        except ValueError:
+            numbers = set(range(1, len(batch) + 1))
+        unsupported.extend(claim for i, claim in enumerate(batch) if i + 1 in numbers)
+
+    if not unsupported:
+        return {"retry": "no", "unsupported_claims": []}
+    if state.max_retry <= 0:
+        listed_claims = "\n".join(f"- {claim}" for claim in unsupported)
+        hallucination_message = f"WARNING **UNSUPPORTED CLAIMS**\n{listed_claims}\n\n{text}"
+        return {"retry": "no", "unsupported_claims": [], field_name: hallucination_message}
+    return {"retry": "fix", "unsupported_claims": unsupported}
+
+
+def fix_claims(state, llm, field_name, sources):
+    """Rewrite, or remove, the unsupported claims of a field concurrently.
+
+    Args:
+        state (dict): Input state containing the field to fix.
+        llm (ChatGroq): Language model instance used for the rewriting.
+        field_name (str): Field to fix.
+        sources (str): Material the field must be grounded in.
+
+    Returns:
+        dict: Fixed field and the rewritten claims to verify again.
+
+    """
+    source_chunks = split_chunks(sources)
+    inputs = [
+        {
+            "claim": claim,
+            "sources": "\n\n".join(
+                rank_chunks(source_chunks, claim, config["hallucination"]["sources_per_batch"])
+            ),
+        }
+        for claim in state.unsupported_claims
+    ]
+    fixer = llm | StrOutputParser()
+    try:
+        rendered_prompts = [prompts.render("CLAIMS_FIX_PROMPT", values) for values in inputs]
+        with call_class(VERIFICATION):
+            answers = fixer.batch(
+                rendered_prompts, {"max_concurrency": config["hallucination"]["max_concurrency"]}
+            )
+    except Exception as e:
+        _save_and_exit(state, e)
+
+    text = getattr(state, field_name)
+    rewritten = []
+    for claim, answer in zip(state.unsupported_claims, answers):
+        fixed_claim = answer.strip()
+        if fixed_claim in {"", "REMOVE"}:
+            text = text.replace(claim, "")
+        else:
+            text = text.replace(claim, fixed_claim)
+            rewritten.append(fixed_claim)
+    text = "\n".join(line for line in text.splitlines() if BULLET.sub("", line).strip() or not line)
+    return {field_name: text, "unsupported_claims": rewritten, "max_retry": state.max_retry - 1}
@@ -0,0 +1,108 @@
+"Memoization of task outputs by input hash."
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from constants import CONFIG_FILE, MEMO_DIR
+from utils.budget import budget_usage
+from utils.load_data import load_config
+from utils.prompts import prompt_text
+
+config = load_config(CONFIG_FILE)
+
+TASK_PROMPTS = {
+    "search": [
+        "SEARCH_SUMMARY_PROMPT",
+        "SEARCH_SUMMARY_UPDATE_PROMPT",
+        "SEARCH_SUMMARY_HALLUCINATION",
+    ],
+    "create": ["CREATE_OUTPUT_PROMPT", "CREATE_OUTPUT_HALLUCINATION"],
+    "format": ["PRE_REPORT_PROMPT", "REPORT_PROMPT", "OUTLINE_PROMPT", "SECTION_PROMPT"],
+    "smart_search": [
+        "SMART_SEARCH_QUERIES_PROMPT",
+        "SMART_SEARCH_FOLLOWUPS_PROMPT",
+        "SEARCH_SUMMARY_PROMPT",
+        "SEARCH_SUMMARY_UPDATE_PROMPT",
+        "SEARCH_SUMMARY_HALLUCINATION",
+    ],
+    "digest": ["DIGEST_PROMPT"],
+}
+# Outputs may be prefilled by a prefetch, they are not inputs.
+IGNORED_ARGS = {
+    "load_recovery",
+    "recovery_path",
+    "search_summary",
+    "create_output",
+    "report",
+    "smart_search_summary",
+}
+FLAG = "WARNING **"
+# Degradations changing an output without changing its inputs.
+UNKEYED_CUTS = {"Hallucination checks skipped.", "Web searches reduced to basic depth."}
+
+
+def task_key(task_type, state_args):
+    """Hash everything a task output depends on.
+
+    The inputs of the task (query, background assembled from the dependency outputs, search
+    results), the text of its prompts, the model and the generation settings.
+
+    Args:
+        task_type (str): Type of the task.
+        state_args (dict): Initial state of the task.
+
+    Returns:
+        str: Key of the task output.
+
+    """
+    inputs = {key: value for key, value in state_args.items() if key not in IGNORED_ARGS}
+    content = {
+        "task_type": task_type,
+        "inputs": inputs,
+        "prompts": [prompt_text(name) for name in TASK_PROMPTS[task_type]],
+        "model": os.getenv("MODEL_NAME", "llama3-70b-8192"),
+        "settings": [
+            config["hallucination"]["mode"],
+            config["parameters"]["sectioned_report"],
+            config["search"]["summary_batch"],
+            config["smart_search"],
+        ],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load(key):
+    """Return the memoized output of a key, or None.
+
+    Args:
+        key (str): Key of the task output.
+
+    """
+    if not config["memo"]["enabled"]:
+        return None
+    path = MEMO_DIR / f"{key}.json"
+    if not path.exists():
+        return None
+    with Path.open(path, encoding="utf-8") as f:
+        return json.load(f)["output"]
+
+
+def save(key, task_type, output):
+    """Memoize a task output, unless it was flagged or its run degraded the checks or searches.
+
+    Args:
+        key (str): Key of the task output.
+        task_type (str): Type of the task.
+        output (str): Output of the task.
+
+    """
+    if not config["memo"]["enabled"] or output.startswith(FLAG):
+        return
+    if UNKEYED_CUTS & set(budget_usage().get("cuts", [])):
+        return
+    Path.mkdir(MEMO_DIR, exist_ok=True, parents=True)
+    with Path.open(MEMO_DIR / f"{key}.json", "w", encoding="utf-8") as f:
+        json.dump({"task_type": task_type, "timestamp": time.time(), "output": output}, f)
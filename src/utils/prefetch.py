@@ -0,0 +1,74 @@
+"Run-scoped prefetching of planned tasks."
+
+import asyncio
+
+_prefetches = {}
+
+
+def discard(run_key):
+    """Cancel and forget the prefetched tasks of a run.
+
+    Args:
+        run_key (str): Identifier of the run.
+
+    """
+    entry = _prefetches.pop(run_key, None)
+    for task in (entry or {}).get("results", {}).values():
+        task.cancel()
+
+
+def start(run_key, tasks, fetch, task_type="search"):
+    """Start prefetching the tasks of a given type of a plan, replacing any previous plan.
+
+    Args:
+        run_key (str): Identifier of the run.
+        tasks (list): Planned tasks.
+        fetch (Callable): Coroutine function called with the index and query of a task.
+        task_type (str): Type of the tasks to prefetch.
+
+    """
+    discard(run_key)
+    _prefetches[run_key] = {
+        "tasks": [list(task) for task in tasks],
+        "results": {
+            i: asyncio.create_task(fetch(i, task[1]))
+            for i, task in enumerate(tasks)
+            if task and task[0] == task_type
+        },
+    }
+
+
+def take(run_key, tasks):
+    """Take the prefetched results of a run, if they were started for the same plan.
+
+    Args:
+        run_key (str): Identifier of the run.
+        tasks (list): Approved tasks.
+
+    Returns:
+        dict: Prefetching asyncio tasks by task index.
+
+    """
+    entry = _prefetches.get(run_key)
+    if entry is None or entry["tasks"] != [list(task) for task in tasks]:
+        discard(run_key)
+        return {}
+    return _prefetches.pop(run_key)["results"]
+
+
+async def result(prefetched, index):
+    """Return the prefetched result of a task, or None if it is missing or failed.
+
+    Args:
+        prefetched (dict): Prefetching asyncio tasks by task index.
+        index (int): Index of the task.
+
+    """
+    task = prefetched.get(index)
+    if task is None or task.cancelled():
+        return None
+    try:
+        return await task
+    except Exception as e:
+        print(f"Prefetch of task {index} failed, running it again.\n\n{e}")
+        return None
@@ -0,0 +1,102 @@
+"Registry of the prompt templates, loaded, validated and compiled once."
+
+import json
+import re
+import sys
+import threading
+from pathlib import Path
+
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+from constants import CONFIG_FILE, PROMPT_FILE
+from utils.load_data import load_config
+from utils.text import estimate_tokens
+
+config = load_config(CONFIG_FILE)
+
+VARIABLE = re.compile(r"(?<!\{)\{(\w+)\}")
+
+with Path.open(PROMPT_FILE, encoding="utf-8") as file:
+    PROMPTS = json.load(file)
+
+_usage = {}
+_lock = threading.Lock()
+
+
+def _compile(name, entry):
+    """Compile a prompt, checking that its keywords are exactly the variables of its text.
+
+    Prompts with a "human" text are graders: "text" is the system message and "human" the
+    message holding the material to grade.
+    """
+    texts = [entry["text"], entry.get("human", "")]
+    variables = {variable for text in texts for variable in VARIABLE.findall(text)}
+    if variables != set(entry.get("keywords", [])):
+        print(f"Prompt {name}: keywords {entry.get('keywords', [])} do not match {variables}.")
+        sys.exit(1)
+    if "human" in entry:
+        return ChatPromptTemplate.from_messages(
+            [("system", entry["text"]), ("human", entry["human"])]
+        )
+    return PromptTemplate(template=entry["text"], input_variables=entry.get("keywords", []))
+
+
+TEMPLATES = {name: _compile(name, entry) for name, entry in PROMPTS.items()}
+
+
+def keywords(name):
+    """Return the variables of a prompt."""
+    return PROMPTS[name].get("keywords", [])
+
+
+def prompt_text(name):
+    """Return the full text of a prompt, before rendering."""
+    return PROMPTS[name]["text"] + PROMPTS[name].get("human", "")
+
+
+def prefix_tokens(name):
+    """Return the estimated tokens of the static prefix of a prompt, shared by all its calls."""
+    text = prompt_text(name)
+    match = VARIABLE.search(text)
+    return estimate_tokens(text[: match.start()] if match else text)
+
+
+def render(name, values):
+    """Render a prompt, recording its estimated tokens and enforcing the prompt limit.
+
+    Args:
+        name (str): Name of the prompt.
+        values (dict): Values of the variables of the prompt.
+
+    Returns:
+        str or list: Rendered prompt, or messages for graders.
+
+    Raises:
+        ValueError: If the prompt exceeds config["llm"]["max_prompt_tokens"].
+
+    """
+    compiled = TEMPLATES[name]
+    if isinstance(compiled, ChatPromptTemplate):
+        rendered = compiled.format_messages(**values)
+        tokens = sum(estimate_tokens(message.content) for message in rendered)
+    else:
+        rendered = compiled.format(**values)
+        tokens = estimate_tokens(rendered)
+    with _lock:
+        usage = _usage.setdefault(
+            name, {"calls": 0, "tokens": 0, "max_tokens": 0, "prefix_tokens": prefix_tokens(name)}
+        )
+        usage["calls"] += 1
+        usage["tokens"] += tokens
+        usage["max_tokens"] = max(usage["max_tokens"], tokens)
+    limit = config["llm"]["max_prompt_tokens"]
+    if limit and tokens > limit:
+        message = f"Prompt {name} has about {tokens} tokens, above the limit of {limit}."
+        raise ValueError(message)
+    return rendered
+
+
+def prompt_stats():
+    """Return the calls, estimated tokens and static prefix tokens of each prompt."""
+    with _lock:
+        return {name: dict(usage) for name, usage in _usage.items()}
@@ -1,12 +1,16 @@
 "Save file utility functions."
 
+import asyncio
 import json
 from dataclasses import asdict
+from functools import cache
 from pathlib import Path
 
 import pypandoc
 
-from constants import OUTPUT_DIR
+from constants import EXPORT_SCRIPT, OUTPUT_DIR
+
+_checkpoint_writers = {}
 
 
 def mk_output_dir(name):
@@ -45,30 +49,106 @@ def save_md(content, directory, file_name="report.md"):
         file.write(_fix_title(content))
 
 
-def md_to_docx(directory, file_name="report.md"):
-    """Convert .md files to .docx files following a template.
+def save_task_output(content, directory, index, task_type):
+    """Save the output of a single task as soon as it is available.
 
     Args:
+        content (str): Output of the task.
         directory (Path): Path of the output directory.
-        file_name (str): The name of the file to convert.
+        index (int): Index of the task in the plan.
+        task_type (str): Type of the task.
+
+    Returns:
+        Path: Path of the saved file.
+
+    """
+    path = directory / "tasks" / f"{index:02d}_{task_type}.md"
+    Path.mkdir(path.parent, exist_ok=True, parents=True)
+    with Path.open(path, "w", encoding='utf-8') as file:
+        file.write(content)
+    return path
+
+
+@cache
+def pandoc_path():
+    """Resolve the pandoc executable once per process, downloading it if missing.
+
+    Returns:
+        str: Path of the pandoc executable.
 
     """
     try:
-        pypandoc.get_pandoc_version()
+        return pypandoc.get_pandoc_path()
     except OSError:
         pypandoc.download_pandoc()
+        return pypandoc.get_pandoc_path()
 
-    path_md = directory / file_name
-    path_docx = directory / file_name.replace(".md", ".docx")
 
-    with Path.open(path_md, encoding='utf-8') as f:
-        text_md = f.read()
+async def _run_pandoc(args, text):
+    """Run pandoc on the given text without blocking the event loop.
 
-    extra_args = [f"--reference-doc={OUTPUT_DIR / 'template.docx'}"]
+    Args:
+        args (list): Command line arguments of pandoc.
+        text (str): Content passed to the standard input.
 
-    pypandoc.convert_text(
-        text_md, to='docx', format='md', outputfile=path_docx, extra_args=extra_args
+    """
+    pandoc = await asyncio.to_thread(pandoc_path)
+    process = await asyncio.create_subprocess_exec(
+        pandoc,
+        *args,
+        stdin=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
     )
+    _, stderr = await process.communicate(text.encode('utf-8'))
+    if process.returncode:
+        message = f"Pandoc died with exitcode {process.returncode}: {stderr.decode()}"
+        raise RuntimeError(message)
+
+
+async def export_reports(reports, formats=("docx",), pdf_engine="pdflatex", file_name="report"):
+    """Export markdown reports to several formats in parallel.
+
+    DOCX and HTML outputs of all the reports are written by a single pandoc process,
+    PDF outputs by one pandoc process per report, all running concurrently.
+
+    Args:
+        reports (list): Pairs of markdown content and output directory.
+        formats (tuple): Output formats among "docx", "html" and "pdf".
+        pdf_engine (str): Engine used by pandoc to produce PDF files.
+        file_name (str): Name of the output files, without extension.
+
+    """
+    jobs = [
+        {
+            "text": _fix_title(content),
+            "outputs": [
+                {
+                    "format": export_format,
+                    "path": str(directory / f"{file_name}.{export_format}"),
+                    "reference_doc": str(OUTPUT_DIR / "template.docx"),
+                }
+                for export_format in formats
+                if export_format != "pdf"
+            ],
+        }
+        for content, directory in reports
+    ]
+    conversions = []
+    if any(job["outputs"] for job in jobs):
+        conversions.append(_run_pandoc(["lua", str(EXPORT_SCRIPT)], json.dumps(jobs)))
+    if "pdf" in formats:
+        conversions.extend(
+            _run_pandoc(
+                [
+                    "--from=markdown",
+                    f"--pdf-engine={pdf_engine}",
+                    f"--output={directory / f'{file_name}.pdf'}",
+                ],
+                _fix_title(content),
+            )
+            for content, directory in reports
+        )
+    await asyncio.gather(*conversions)
 
 
 def save_state(state, path):
@@ -78,6 +158,48 @@ def save_state(state, path):
         state (OverallState): State of the graph.
         path (str): Path of the recovery file.
 
+    """
+    save_json(asdict(state), path)
+
+
+def save_json(content, path):
+    """Write content in a json file.
+
+    Args:
+        content (dict): Json serializable content.
+        path (str): Path of the file.
+
     """
     with Path.open(Path(path), 'w', encoding='utf-8') as f:
-        json.dump(asdict(state), f, indent=2)
+        json.dump(content, f, indent=2)
+
+
+async def _write_checkpoints(path):
+    """Write the pending snapshots of a path until none is left."""
+    writer = _checkpoint_writers[path]
+    while writer["pending"] is not None:
+        snapshot, writer["pending"] = writer["pending"], None
+        await asyncio.to_thread(save_json, snapshot, path)
+
+
+def asave_state(state, path):
+    """Save state of the search in a json file, without blocking the event loop.
+
+    Must be called from a running event loop. At most one write per path is in flight:
+    a snapshot saved while a write is running replaces any snapshot still waiting, so
+    only the latest one is written.
+
+    Args:
+        state (OverallState): State of the graph.
+        path (str): Path of the recovery file.
+
+    Returns:
+        asyncio.Task: Task writing the snapshot, awaitable for durability.
+
+    """
+    path = str(path)
+    writer = _checkpoint_writers.setdefault(path, {"pending": None, "task": None})
+    writer["pending"] = asdict(state)
+    if writer["task"] is None or writer["task"].done():
+        writer["task"] = asyncio.create_task(_write_checkpoints(path))
+    return writer["task"]
@@ -0,0 +1,141 @@
+"Priority and fairness scheduling of the calls sharing a rate limiter."
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# Call classes, served in this order.
+CRITICAL = 0
+GENERATION = 1
+VERIFICATION = 2
+
+current_run = ContextVar("current_run", default=("default", 1))
+current_call_class = ContextVar("current_call_class", default=GENERATION)
+
+
+def start_run(run_id, priority=1):
+    """Identify the calls of the current context as calls of a run.
+
+    Args:
+        run_id (str): Identifier of the run.
+        priority (float): Weight of the run, a run of priority 2 is served twice as often
+            as a run of priority 1 when both are waiting.
+
+    """
+    current_run.set((run_id, priority))
+
+
+@contextmanager
+def call_class(value):
+    """Set the class of the calls made within the block."""
+    token = current_call_class.set(value)
+    try:
+        yield
+    finally:
+        current_call_class.reset(token)
+
+
+class FairRateLimiter(BaseRateLimiter):
+    """Grant the tokens of a rate limiter by call class, then by weighted fair queuing.
+
+    Waiting calls are served by class (critical, generation, verification), and within a
+    class by virtual finish time: each run advances its virtual time by 1 / priority per
+    call, so runs share the rate in proportion to their priorities.
+    """
+
+    def __init__(self, rate_limiter, check_every_n_seconds=0.1):
+        """Wrap a rate limiter.
+
+        Args:
+            rate_limiter (BaseRateLimiter): Rate limiter providing the tokens.
+            check_every_n_seconds (float): Polling period of the waiting calls.
+
+        """
+        self.rate_limiter = rate_limiter
+        self.check_every_n_seconds = check_every_n_seconds
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}
+        self._waits = {}
+
+    def _enqueue(self):
+        """Queue a call of the current run and class."""
+        run_id, priority = current_run.get()
+        with self._lock:
+            start = max(self._virtual_time, self._last_finish.get(run_id, 0.0))
+            finish = start + 1 / priority
+            self._last_finish[run_id] = finish
+            entry = (current_call_class.get(), finish, next(self._sequence), run_id)
+            heapq.heappush(self._queue, entry)
+        return entry
+
+    def _grant(self, entry):
+        """Grant a token to the call if it is first in the queue and a token is available."""
+        with self._lock:
+            if self._queue[0] is not entry or not self.rate_limiter.acquire(blocking=False):
+                return False
+            heapq.heappop(self._queue)
+            self._virtual_time = entry[1]
+            return True
+
+    def _dequeue(self, entry):
+        """Remove a call that gave up waiting."""
+        with self._lock:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def _record_wait(self, run_id, wait):
+        """Record the time a call of a run waited for its token."""
+        with self._lock:
+            waits = self._waits.setdefault(run_id, {"calls": 0, "total_wait": 0.0, "max_wait": 0.0})
+            waits["calls"] += 1
+            waits["total_wait"] += wait
+            waits["max_wait"] = max(waits["max_wait"], wait)
+
+    def acquire(self, *, blocking=True):
+        """Wait for the turn of the call and for a token."""
+        entry = self._enqueue()
+        started = time.monotonic()
+        try:
+            while not self._grant(entry):
+                if not blocking:
+                    self._dequeue(entry)
+                    return False
+                time.sleep(self.check_every_n_seconds)
+        except BaseException:
+            self._dequeue(entry)
+            raise
+        self._record_wait(entry[3], time.monotonic() - started)
+        return True
+
+    async def aacquire(self, *, blocking=True):
+        """Wait for the turn of the call and for a token, without blocking the event loop."""
+        entry = self._enqueue()
+        started = time.monotonic()
+        try:
+            while not self._grant(entry):
+                if not blocking:
+                    self._dequeue(entry)
+                    return False
+                await asyncio.sleep(self.check_every_n_seconds)
+        except BaseException:
+            self._dequeue(entry)
+            raise
+        self._record_wait(entry[3], time.monotonic() - started)
+        return True
+
+    def stats(self):
+        """Return the queue depth and the waiting times of each run."""
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "runs": {run_id: dict(waits) for run_id, waits in self._waits.items()},
+            }
@@ -0,0 +1,53 @@
+"LLM output schemas."
+
+from typing import Union
+
+from pydantic import BaseModel, Field
+
+
+class Tasks(BaseModel):
+    """Plan of tasks producing the report."""
+
+    tasks: list[list[Union[str, list[str], list[int]]]] = Field(
+        description=(
+            "Ordered tasks. Each task is [type, content, dependencies]: type is one of "
+            '"search", "create", "smart_search" or "format"; content is a list of queries '
+            'for "search", a query for "create" and "" otherwise; dependencies are indices '
+            "of previous tasks."
+        )
+    )
+
+
+class SmartSearchQueries(BaseModel):
+    """Web search queries exploring the background."""
+
+    smart_search_queries: list[str] = Field(description="Search queries, at most 6.")
+
+
+class SmartSearchFollowups(BaseModel):
+    """Refined web search queries for the information not found yet."""
+
+    smart_search_followups: list[str] = Field(description="Refined search queries.")
+
+
+class OutlineSection(BaseModel):
+    """Section of the report outline."""
+
+    heading: str = Field(description="Heading of the section.")
+    description: str = Field(description="Expected content of the section.")
+    sources: list[int] = Field(description="Indices of the relevant background parts.")
+
+
+class Outline(BaseModel):
+    """Title and sections of the report."""
+
+    title: str = Field(description="Title of the report.")
+    outline: list[OutlineSection] = Field(description="Sections of the report, in order.")
+
+
+JSON_SCHEMAS = {
+    "tasks": Tasks,
+    "smart_search_queries": SmartSearchQueries,
+    "smart_search_followups": SmartSearchFollowups,
+    "outline": Outline,
+}
@@ -0,0 +1,93 @@
+"Coalescing of identical in-flight calls."
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, sharing its result with concurrent duplicates.
+
+    The first caller of a key performs the call, callers arriving before it completes wait
+    for the same result (or exception). Works from threads (run) and coroutines (arun).
+
+    Fields:
+        calls (int): Number of calls performed.
+        deduplicated (int): Number of calls answered by an in-flight call.
+    """
+
+    def __init__(self):
+        """Initialise an empty registry of in-flight calls."""
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    def _join(self, key):
+        """Return the future of the key and whether the caller must perform the call."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.calls += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, exception=None):
+        """Publish the outcome of the call and remove it from the in-flight calls."""
+        with self._lock:
+            del self._in_flight[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def run(self, key, function):
+        """Call function, unless an identical call is already in flight.
+
+        Args:
+            key (Hashable): Identity of the call.
+            function (Callable): Function performing the call.
+
+        Returns:
+            Result of the call.
+
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def arun(self, key, function):
+        """Await function(), unless an identical call is already in flight.
+
+        Args:
+            key (Hashable): Identity of the call.
+            function (Callable): Coroutine function performing the call.
+
+        Returns:
+            Result of the call.
+
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await function()
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def stats(self):
+        """Return the call counters."""
+        return {"calls": self.calls, "deduplicated": self.deduplicated}
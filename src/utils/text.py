@@ -0,0 +1,175 @@
+"Local text processing utility functions."
+
+import re
+from collections import Counter
+
+TERM = re.compile(r"\w{3,}")
+WORD = re.compile(r"\w+")
+ENTITY = re.compile(r"https?://\S+|\b\d[\d.,%]*\b|\b[A-Z][\w&.-]*[A-Za-z0-9]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[*])")
+BULLET = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+CITATION = re.compile(r"https?://\S+|\[\d+\]")
+
+
+def terms(text):
+    """Return the set of lowercase terms (3 characters or more) of a text."""
+    return set(TERM.findall(text.lower()))
+
+
+def coverage(text, reference_terms):
+    """Return the share of the terms of a text found in a set of terms, 1 without terms."""
+    text_terms = terms(text)
+    return len(text_terms & reference_terms) / len(text_terms) if text_terms else 1.0
+
+
+def split_chunks(text):
+    """Split a text in paragraphs."""
+    return [chunk.strip() for chunk in text.split("\n\n") if chunk.strip()]
+
+
+def split_claims(text, min_words=5):
+    """Split a text in claims: sentences of bullet points and paragraphs.
+
+    Headings and fragments shorter than min_words are not claims.
+
+    Args:
+        text (str): Text to split.
+        min_words (int): Minimum number of words of a claim.
+
+    Returns:
+        list: Claims, as they appear in the text.
+
+    """
+    claims = []
+    for line in text.splitlines():
+        content = BULLET.sub("", line).strip()
+        if not content or content.startswith("#"):
+            continue
+        claims.extend(
+            sentence.strip()
+            for sentence in SENTENCE_END.split(content)
+            if len(sentence.split()) >= min_words
+        )
+    return claims
+
+
+def rank_chunks(chunks, text, k):
+    """Return the k chunks sharing the most terms with a text, in their original order.
+
+    Args:
+        chunks (list): Candidate chunks.
+        text (str): Reference text.
+        k (int): Number of chunks to keep.
+
+    Returns:
+        list: Selected chunks.
+
+    """
+    if len(chunks) <= k:
+        return chunks
+    text_terms = terms(text)
+    scores = [len(text_terms & terms(chunk)) for chunk in chunks]
+    best = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)[:k]
+    return [chunks[i] for i in sorted(best)]
+
+
+def ngrams(text, n=3):
+    """Return the set of lowercase word n-grams of a text."""
+    words = WORD.findall(text.lower())
+    return set(zip(*[words[i:] for i in range(n)]))
+
+
+def grounding_score(text, sources, n=3):
+    """Score how much of a text is found in its sources, between 0 and 1.
+
+    The score is the lowest of the share of word n-grams of the text found in the sources and
+    the share of its entities (numbers, URLs and capitalised words) found in the sources.
+
+    Args:
+        text (str): Generated text.
+        sources (str): Material the text must be grounded in.
+        n (int): Size of the n-grams.
+
+    Returns:
+        float: Grounding score.
+
+    """
+    text_ngrams = ngrams(text, n)
+    if not text_ngrams:
+        return 0.0
+    ngram_share = len(text_ngrams & ngrams(sources, n)) / len(text_ngrams)
+    entities = {entity.rstrip(".,").lower() for entity in ENTITY.findall(text)}
+    source_text = sources.lower()
+    entity_share = (
+        sum(entity in source_text for entity in entities) / len(entities) if entities else 1.0
+    )
+    return min(ngram_share, entity_share)
+
+
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens of a text, about 4 characters per token."""
+    return -(-len(text) // 4)
+
+
+def _units(text):
+    """Split a text into headings and sentences, with the index of the line holding them."""
+    units = []
+    for line_index, line in enumerate(text.splitlines()):
+        if line.lstrip().startswith("#"):
+            units.append((line_index, line))
+        elif line.strip():
+            units.extend((line_index, sentence) for sentence in SENTENCE_END.split(line))
+    return units
+
+
+def _assemble(units, kept):
+    """Join the kept units, in their original lines and paragraphs."""
+    lines = {}
+    for i in sorted(kept):
+        lines.setdefault(units[i][0], []).append(units[i][1])
+    paragraphs, previous = [], None
+    for line_index, sentences in lines.items():
+        separator = "\n" if previous == line_index - 1 else "\n\n"
+        paragraphs.append((separator if paragraphs else "") + " ".join(sentences))
+        previous = line_index
+    return "".join(paragraphs)
+
+
+def compress(text, max_tokens, query=""):
+    """Keep the most relevant sentences of a text within a token budget, in their original order.
+
+    Sentences are never cut, so citations and URLs stay intact. Headings are kept first, then
+    sentences are ranked by the query terms they contain, the citations they hold and how
+    central their terms are to the text.
+
+    Args:
+        text (str): Text to compress.
+        max_tokens (int): Token budget of the compressed text.
+        query (str): Query the text must stay relevant to.
+
+    Returns:
+        str: Compressed text.
+
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    units = _units(text)
+    unit_terms = [terms(unit) for _, unit in units]
+    counts = Counter(term for unit in unit_terms for term in unit)
+    query_terms = terms(query)
+
+    def score(i):
+        unit = units[i][1]
+        if unit.lstrip().startswith("#"):
+            return float("inf")
+        centrality = sum(counts[term] for term in unit_terms[i]) / (len(unit_terms[i]) + 1)
+        citations = bool(CITATION.search(unit))
+        return 2 * len(query_terms & unit_terms[i]) + citations + centrality / len(units)
+
+    kept, used = set(), 0
+    for i in sorted(range(len(units)), key=score, reverse=True):
+        tokens = estimate_tokens(units[i][1]) + 1
+        if used + tokens <= max_tokens:
+            kept.add(i)
+            used += tokens
+    return _assemble(units, kept)
@@ -5,11 +5,16 @@ import os
 import sys
 
 from dotenv import load_dotenv
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from tavily import AsyncTavilyClient, TavilyClient
 
 from constants import CONFIG_FILE
+from utils import knowledge
+from utils.budget import degraded, record_search_calls
 from utils.load_data import load_api_key, load_config
-from utils.save_file import save_state
+from utils.save_file import asave_state
+from utils.scheduler import FairRateLimiter
+from utils.single_flight import SingleFlight
 
 load_api_key(['tavily'])
 load_dotenv()
@@ -32,10 +37,162 @@ search_params = {
 if tavily_config["topic"] == "news":
     search_params["days"] = tavily_config["days"]
 
+search_flight = SingleFlight()
+
+search_rate_limiter = FairRateLimiter(
+    InMemoryRateLimiter(
+        requests_per_second=config["scheduler"]["search_requests_per_second"],
+        check_every_n_seconds=0.1,
+        max_bucket_size=10,
+    )
+)
+
+
+async def tavily_search(query):
+    """Search the web for a query, sharing the response with identical in-flight searches.
+
+    When the run is close to its budget, the search depth and the number of results shrink.
+
+    Args:
+        query (str): Search query.
+
+    Returns:
+        dict: Tavily response.
+
+    """
+    params = search_params
+    if degraded("Web searches reduced to basic depth."):
+        params = {**search_params, "search_depth": "basic", "max_results": 2}
+        params.pop("chunks_per_source")
+
+    async def search():
+        await search_rate_limiter.aacquire()
+        record_search_calls(1)
+        return await tavily_async_client.search(query, **params)
+
+    return await search_flight.arun((query, *sorted(params.items())), search)
+
+
+async def search_query(query):
+    """Answer a query from the knowledge index, searching the web only if needed.
+
+    Args:
+        query (str): Search query.
+
+    Returns:
+        dict: Tavily-like response.
+
+    """
+    results = await asyncio.to_thread(knowledge.lookup, query)
+    if results:
+        return {"results": results}
+    response = await tavily_search(query)
+    await asyncio.to_thread(knowledge.add_search, query, response["results"])
+    return response
+
+
+class SourceCollector:
+    """Deduplicate the sources of search responses as they arrive.
+
+    The sources are ordered by the query and the rank where they first appear, whatever the
+    order of arrival of the responses.
+    """
+
+    def __init__(self):
+        """Start with no source."""
+        self._positions = {}
+
+    def add(self, index, response):
+        """Add the response of the query of a given index, returning its new sources."""
+        new_sources = []
+        for rank, entry in enumerate(response["results"]):
+            content = entry["content"]
+            position = self._positions.get(content)
+            if position is None:
+                new_sources.append(content)
+            if position is None or (index, rank) < position:
+                self._positions[content] = (index, rank)
+        return new_sources
+
+    def sources(self):
+        """Return the sources."""
+        return sorted(self._positions, key=self._positions.get)
+
+    def text(self):
+        """Return the sources separated by blank lines."""
+        return "\n\n".join(self.sources())
+
+
+_stragglers = set()
+
+
+def _forget_straggler(task):
+    """Release a dropped search once it completes."""
+    _stragglers.discard(task)
+    if not task.cancelled():
+        task.exception()
+
+
+async def stream_search(queries):
+    """Search each query, yielding the responses as they complete.
+
+    Queries still running config["search"]["deadline_seconds"] after the start are dropped,
+    once at least one response arrived: the first response is awaited whatever the
+    deadline. Dropped queries are not cancelled: identical searches of other
+    tasks may share them, and their results still reach the knowledge index.
+
+    Args:
+        queries (list): Search queries.
+
+    Yields:
+        tuple: Index of the query and its response.
+
+    """
+    loop = asyncio.get_running_loop()
+    deadline = config["search"]["deadline_seconds"]
+    end = loop.time() + deadline
+    tasks = {asyncio.ensure_future(search_query(query[:400])): i for i, query in enumerate(queries)}
+    pending = set(tasks)
+    received = False
+    try:
+        while pending:
+            timeout = max(end - loop.time(), 0) if deadline and received else None
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"Dropped {len(pending)} search queries past the {deadline}s deadline.")
+                return
+            for task in sorted(done, key=tasks.get):
+                received = True
+                yield tasks[task], task.result()
+    finally:
+        for task in pending:
+            _stragglers.add(task)
+            task.add_done_callback(_forget_straggler)
+
+
+async def collect_sources(queries):
+    """Search each query and join the deduplicated sources of the responses.
+
+    Args:
+        queries (list): Search queries.
+
+    Returns:
+        str: Sources separated by blank lines.
+
+    """
+    collector = SourceCollector()
+    async for index, response in stream_search(queries):
+        collector.add(index, response)
+    return collector.text()
+
 
 async def web_search(state, field_name, queries):
     """Search the web for each query and returns a formatted string of sources.
 
+    Responses are deduplicated as they arrive.
+
     Args:
         state (StateGraph State): The state of the graph.
         field_name (str): The name of the field in the state that will hold the search results.
@@ -51,24 +208,13 @@ async def web_search(state, field_name, queries):
         state.load_recovery = False
 
         try:
-            formatted_queries = [query[:400] for query in queries]
-            search_results = await asyncio.gather(
-                *[tavily_async_client.search(query, **search_params) for query in formatted_queries]
-            )
+            sources = await collect_sources(queries)
         except Exception as e:
             print(e)
             state.load_recovery = True
             path = state.recovery_path
-            save_state(state, path)
+            await asave_state(state, path)
             sys.exit(1)
 
-        sources = [
-            entry['content']
-            for search_result in search_results
-            for entry in search_result['results']
-        ]
-
-        unique_sources = list(set(sources))
-
-        return {field_name: "\n\n".join(unique_sources), "load_recovery": False}
+        return {field_name: sources, "load_recovery": False}
     return {}